@@ -1,30 +1,43 @@
-# Set to True to use spinner, false to show full file logs
+# Set to True to show a progress line, false to show full file logs
 USE_SPINNER = True
 
+# Set to True to convert with worker processes, false to convert with worker threads
+USE_PROCESS_POOL = True
 
-import tempfile
-import shutil
-import zipfile
-import yaml
-import unicodedata
-from collections import defaultdict
-from typing import Final
-from concurrent.futures import ThreadPoolExecutor
+# Set to True to copy unchanged members without recompressing them, false to recompress every member
+RAW_COPY_MEMBERS = True
+
+# Set to True to memory-map the files being converted, false to read them through regular file reads
+MAP_SOURCE_ARCHIVES = False
+
+
+from collections import Counter, defaultdict
+from typing import TYPE_CHECKING, Final, Iterable, Iterator, TextIO
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ThreadPoolExecutor, wait
+import argparse
+import csv
+import hashlib
+import json
 import logging
+import math
 import os
+import queue
 import threading
 import itertools
 import sys
 import time
+import traceback
 
 
-try:
-    from utils.Audiobank import *
-    USE_NEW_LINKING = True
-except ImportError:
-    USE_NEW_LINKING = False
+from utils.BankCache import BankCache
+from utils.Converter import (
+    CONVERTER_VERSION, COPY_CHUNK_SIZE, SCAN_CONVERTIBLE, SCAN_CONVERTED, SCAN_INCOMPLETE, SCAN_MALFORMED,
+    CompressionPolicy, MetaDiagnostic, StageTimer, convert_archive, scan_file,
+)
 
-FILES = sys.argv[1:]
+# Modules only some modes need are imported where they are used, so that every run starts quickly
+if TYPE_CHECKING:
+    from utils.BankTable import BankTable
 
 # ANSI Terminal Color Codes
 RED: Final        = '\x1b[31m'
@@ -57,412 +70,898 @@ SPINNER_FRAMES: Final[list[str]] = [
     "⠀⢘", "⠀⡘", "⠀⠨", "⠀⢐", "⠀⡐", "⠀⠠", "⠀⢀", "⠀⡀",
 ]
 
-# If the music groups line is empty, assign defaults based on the song type
-DEFAULT_BGM_CATEGORIES: Final[list[str]] = [
-    "Fields", "Town", "Dungeon", "Indoors", "Fun", "Fight", "CharacterTheme",
-]
+# Name of the file in each conversion folder that records which archives have been converted
+MANIFEST_NAME: Final[str] = '.ootrs-manifest.json'
 
-DEFAULT_FANFARE_CATEGORIES: Final[list[str]] = [
-    "EventFanfare", "SongFanfare"
-]
+# Names of the run report written next to the error log, and how many of the slowest files it lists
+REPORT_NAME: Final[str] = 'ootr-music-updater_report'
+REPORT_SLOWEST_FILES: Final[int] = 10
 
-done_flag = threading.Event()
-spinner_thread = threading.Thread()
+# Name of the error logs: a text log with tracebacks, and one JSON record per line
+ERROR_LOG_NAME: Final[str] = 'ootr-music-updater_errors'
 
+# Name of the library inventory written by --scan
+SCAN_NAME: Final[str] = 'ootr-music-updater_scan'
 
-def spinner_task(message: str, done_flag: threading.Event) -> None:
-    for frame in itertools.cycle(SPINNER_FRAMES):
-        if done_flag.is_set():
-            break
-        sys.stderr.write(f"{PL}{CL}{PINK_204}{frame}{RESET} {GRAY_245}{message}{RESET}\n")
-        sys.stderr.flush()
-        time.sleep(0.07)
-    if USE_SPINNER:
-        sys.stderr.write(f"{PL}{CL}{GREEN_79}✓{RESET} {GRAY_245}{message}{RESET}\n")
-    else:
-        sys.stderr.write(f"{GREEN_79}✓{RESET} {GRAY_245}{message}{RESET}\n")
-    sys.stderr.flush()
+# Names of the sample table and findings written by --analyze-banks
+BANKS_NAME: Final[str] = 'ootr-music-updater_banks'
+
+# Conversion stages in the order they run, as recorded by StageTimer
+STAGES: Final[list[str]] = ['hash', 'open', 'meta', 'relink', 'pack', 'metadata']
 
+# Limits for batching archives before handing them to a worker process
+BATCH_MAX_FILES: Final[int] = 16
+BATCH_MAX_BYTES: Final[int] = 16 * 1024 * 1024
 
-def start_spinner(message: str):
-    if not USE_SPINNER:
-        print(f"{GRAY_245}{message}{RESET}")
+# Parsed banks each worker keeps in memory, so identical banks across archives are only parsed once
+BANK_CACHE_ENTRIES: Final[int] = 256
 
-        class DummyThread:
-            def join(self): pass
-        return DummyThread()
+# Batches queued per worker before the folder walk waits for one to finish
+PENDING_BATCHES_PER_WORKER: Final[int] = 4
 
-    done_flag.clear()
-    thread = threading.Thread(target=spinner_task, args=(message, done_flag))
-    thread.start()
-    return thread
+# Seconds between redraws of the progress line, and between progress lines when it cannot be redrawn in place
+PROGRESS_REFRESH_SECONDS: Final[float] = 0.1
+PROGRESS_LINE_SECONDS: Final[float] = 5.0
+
+# Each worker process has its own cache; worker threads share the main process's
+bank_cache = BankCache(BANK_CACHE_ENTRIES)
+
+# How the members of converted archives are compressed, set for each worker when the pool starts
+compression = CompressionPolicy('keep' if RAW_COPY_MEMBERS else 'deflate')
+
+# Whether the files being converted are memory-mapped, set for each worker when the pool starts
+map_archives = MAP_SOURCE_ARCHIVES
+
+
+def configure_worker(bank_cache_folder: str = None, compression_policy: CompressionPolicy = None, map_source_archives: bool = None) -> None:
+    ''' Sets the folder the bank cache persists to, or keeps it in memory only, how members are compressed and whether files are mapped '''
+    global compression, map_archives
+    bank_cache.folder = bank_cache_folder
+    if compression_policy is not None:
+        compression = compression_policy
+    if map_source_archives is not None:
+        map_archives = map_source_archives
 
 
 logger = logging.getLogger('ootr_music_updater')
-logger.setLevel(logging.ERROR)
+logger.setLevel(logging.WARNING)
 logger.propagate = False
-_log_handler = None
+logger.addHandler(logging.NullHandler())
+
+
+class ErrorRecordFormatter(logging.Formatter):
+    ''' Formats the structured record attached to an error as one JSON line '''
 
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps({"time": self.formatTime(record), **record.error_record}, ensure_ascii=False)
 
-def log_error(message: str, exc_info=True):
-    global _log_handler
-    if _log_handler is None:
-        _log_handler = logging.FileHandler('ootr-music-updater_errors.log', mode='a', encoding='utf-8')
-        _log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-        logger.addHandler(_log_handler)
 
-    logger.error(message, exc_info=exc_info)
+class ErrorLog:
+    '''
+    Writes logged errors from a queue on a single thread, which owns the log files.
+
+    Every error goes to the text log with its traceback, and errors that carry a record also go to the
+    JSON lines file. Warnings only go to the text log. Neither file is created until the first entry arrives.
+    '''
+
+    def __init__(self, folder: str = None):
+        self.folder = folder or os.getcwd()
+        self.text_path = os.path.join(self.folder, f"{ERROR_LOG_NAME}.log")
+        self.records_path = os.path.join(self.folder, f"{ERROR_LOG_NAME}.jsonl")
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.listener: 'logging.handlers.QueueListener' = None
+
+    def start(self) -> None:
+        import logging.handlers
+
+        os.makedirs(self.folder, exist_ok=True)
+
+        text_handler = logging.FileHandler(self.text_path, mode='a', encoding='utf-8', delay=True)
+        text_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+        records_handler = logging.FileHandler(self.records_path, mode='a', encoding='utf-8', delay=True)
+        records_handler.setFormatter(ErrorRecordFormatter())
+        records_handler.addFilter(lambda record: hasattr(record, 'error_record'))
+
+        self.listener = logging.handlers.QueueListener(self.queue, text_handler, records_handler)
+        # Replacing the handlers rather than adding one means a second run never writes every error twice
+        logger.handlers = [logging.handlers.QueueHandler(self.queue)]
+        self.listener.start()
+
+    def stop(self) -> None:
+        ''' Writes out every queued error, then closes the log files '''
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+        logger.handlers = [logging.NullHandler()]
+
+
+def log_error(message: str, exc_info=True, error_record: dict = None):
+    logger.error(message, exc_info=exc_info, extra={"error_record": error_record} if error_record is not None else None)
+
+
+def log_warning(message: str):
+    logger.warning(message)
 
 
 def remove_diacritics(text: str) -> str:
     '''Normalizes filenames to prevent errors caused by diacritics'''
+    import unicodedata
+
     normalized = unicodedata.normalize('NFD', text)
     without_diacritics = ''.join(c for c in normalized if unicodedata.category(c) != 'Mn')
 
     return without_diacritics
 
 
-class SkipFileException(Exception):
-    ''' Exception to be raised if a file does not require conversion '''
-    pass
+def processing_file(input_file: str, base_folder: str, conversion_folder: str, timer: StageTimer = None,
+                    diagnostics: list[MetaDiagnostic] = None) -> bool:
+    ''' Processes a single file, returning whether it was converted '''
+    try:
+        extension = os.path.splitext(input_file)[1]
+        relative_path = os.path.relpath(input_file, base_folder)
+        destination_dir = os.path.dirname(os.path.join(conversion_folder, relative_path))
 
+        # Create the destination and copy the file to the destination
+        os.makedirs(destination_dir, exist_ok=True)
 
-class MusicArchive:
-    ''' Represents an .ootrs file storing its contents '''
+        if extension == ".ootrs":
+            return convert_archive(input_file, destination_dir, timer, bank_cache, compression, map_archives, diagnostics)
 
-    def __init__(self, tempfolder):
-        self.sequence: str = None
-        self.meta: str = None
-        self.bank: str = None
-        self.bankmeta: str = None
-        self.zsounds: list[int] = []
-        self.tempfolder = tempfolder
+        return False
+
+    except Exception as e:
+        raise Exception(f"processing_file Error: {e}")
 
-    def unpack(self, filepath: str) -> None:
-        ''' Unpacks the contents of an .ootrs file into the temporary folder '''
-        if os.path.exists(self.tempfolder):
-            os.rmdir(self.tempfolder)
 
-        with zipfile.ZipFile(filepath, 'r') as zip_archive:
-            for f in zip_archive.namelist():
-                if f.endswith(".metadata"):
-                    raise SkipFileException("Archive contains .metadata, skipping.")
-            zip_archive.extractall(self.tempfolder)
+def hash_file(filepath: str) -> str:
+    ''' Hashes a file's contents so that unchanged archives can be recognised '''
+    digest = hashlib.sha256()
 
-        for f in os.listdir(self.tempfolder):
-            # filename = os.path.basename(f)
-            # base_name = os.path.splitext(f)[0]
-            extension = os.path.splitext(f)[1].lower()
+    with open(filepath, 'rb') as f:
+        while chunk := f.read(COPY_CHUNK_SIZE):
+            digest.update(chunk)
 
-            match extension:
-                case '.seq':
-                    self.sequence = f
-                    continue
-                case '.meta':
-                    self.meta = f
-                    continue
-                case '.bankmeta':
-                    self.bankmeta = f
-                    continue
-                case '.zbank':
-                    self.bank = f
-                    continue
-                case '.zsound':
-                    self.zsounds.append(f)
-                    continue
-                case _:
-                    continue
+    return digest.hexdigest()
+
+
+class FileResult:
+    ''' Outcome of processing a single file, sent back from the workers '''
+
+    def __init__(self, input_file: str, converted: bool = False, error: str = None, trace: str = None,
+                 size: int = None, mtime: int = None, digest: str = None,
+                 seconds: float = None, stages: dict[str, tuple[float, int]] = None,
+                 error_type: str = None, failed_stage: str = None, diagnostics: list[str] = None):
+        self.input_file = input_file
+        self.converted = converted
+        self.error = error
+        self.trace = trace
+
+        # The exception that started the failure, and the stage it was raised in
+        self.error_type = error_type
+        self.failed_stage = failed_stage
+
+        # Lines of the .meta file that were ignored or corrected
+        self.diagnostics = diagnostics or []
+
+        # Wall time of the whole file, and the (seconds, bytes) of each stage
+        self.seconds = seconds
+        self.stages = stages or {}
+
+        # The state of the source archive when it was converted, for the conversion manifest
+        self.size = size
+        self.mtime = mtime
+        self.digest = digest
+
+
+def format_duration(seconds: float | None) -> str:
+    if seconds is None:
+        return '--:--'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes}:{seconds:02}"
+
+
+class ProgressDisplay:
+    '''
+    Shows how far the conversion is from counters that only the main thread updates.
+
+    Its own thread redraws a single line at a bounded rate, so workers never wait on the terminal. When stderr
+    is not a terminal, or USE_SPINNER is off, it prints a plain line now and then instead of redrawing. Errors
+    are counted while running and listed once at the end.
+    '''
+
+    def __init__(self, stream: TextIO = None):
+        self.stream = stream or sys.stderr
+        self.interactive = USE_SPINNER and self.stream.isatty()
+        self.lock = threading.Lock()
+        self.total_files = 0
+        self.done_files = 0
+        self.done_bytes = 0
+        self.errors: list[dict] = []
+        self.started = time.perf_counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def add_total(self, files: int) -> None:
+        with self.lock:
+            self.total_files += files
+
+    def add_result(self, result: FileResult) -> None:
+        with self.lock:
+            self.done_files += 1
+            self.done_bytes += result.size or 0
+
+    def add_error(self, record: dict) -> None:
+        with self.lock:
+            self.errors.append(record)
+
+    def status(self) -> str:
+        with self.lock:
+            total_files, done_files, done_bytes, errors = self.total_files, self.done_files, self.done_bytes, len(self.errors)
+
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        files_per_second = done_files / elapsed
+        eta = (total_files - done_files) / files_per_second if done_files else None
+
+        return (f"{done_files}/{total_files} files  {done_bytes / (1024 * 1024) / elapsed:.1f} MB/s  {files_per_second:.1f} files/s  "
+                f"ETA {format_duration(eta)}  {errors} {'error' if errors == 1 else 'errors'}")
+
+    def run(self) -> None:
+        frames = itertools.cycle(SPINNER_FRAMES)
+        interval = PROGRESS_REFRESH_SECONDS if self.interactive else PROGRESS_LINE_SECONDS
+
+        while not self.stopped.wait(interval):
+            if self.interactive:
+                self.stream.write(f"\r{CL}{PINK_204}{next(frames)}{RESET} {GRAY_245}{self.status()}{RESET}")
+            else:
+                self.stream.write(f"{GRAY_245}{self.status()}{RESET}\n")
+            self.stream.flush()
+
+    def start(self) -> None:
+        self.started = time.perf_counter()
+        self.thread.start()
+
+    def stop(self, records_path: str = None) -> None:
+        ''' Stops redrawing, then writes the final counts and every error record that was collected '''
+        self.stopped.set()
+        self.thread.join()
+
+        prefix = f"\r{CL}" if self.interactive else ''
+        self.stream.write(f"{prefix}{GREEN_79}✓{RESET} {GRAY_245}All files processed: {self.status()}{RESET}\n")
+
+        if self.errors:
+            self.stream.write(f"\n{RED}{len(self.errors)} {'file' if len(self.errors) == 1 else 'files'} could not be converted:{RESET}\n")
+            for record in self.errors:
+                stage = f" in the {record['stage']} stage" if record["stage"] else ''
+                self.stream.write(f"{RED}Error processing {record['path']}{stage}:{RESET}\n{YELLOW}{record['exception']}: {record['message']}{RESET}\n")
+            if records_path is not None:
+                self.stream.write(f"{GRAY_245}Details are in {records_path}{RESET}\n")
+
+        self.stream.flush()
+
+
+def root_exception(e: BaseException) -> BaseException:
+    ''' Follows a chain of re-raised exceptions back to the one that started it, which names what went wrong '''
+    seen = {id(e)}
+    while (e.__cause__ or e.__context__) is not None and id(e.__cause__ or e.__context__) not in seen:
+        e = e.__cause__ or e.__context__
+        seen.add(id(e))
+    return e
+
+
+def error_record(result: FileResult) -> dict:
+    ''' The structured form of a file's error, as written to the JSON lines log '''
+    return {
+        "path": result.input_file,
+        "stage": result.failed_stage,
+        "exception": result.error_type,
+        "message": result.error,
+    }
 
-        if not self.sequence:
-            raise FileNotFoundError(f'MusicArchive Error: No sequence file found!')
-        if not self.meta:
-            raise FileNotFoundError(f'MusicArchive Error: No meta file found!')
 
-        if self.bank and not self.bankmeta:
-            raise FileNotFoundError(f'MusicArchive Error: No bankmeta file found!')
-        if not self.bank and self.bankmeta:
-            raise FileNotFoundError(f'MusicArchive Error: No bank file found!')
+class ConversionManifest:
+    ''' Records the source archives already converted into a conversion folder, so reruns can skip them '''
 
+    def __init__(self, conversion_folder: str, compression: str = None):
+        self.conversion_folder = conversion_folder
+        self.compression = compression or str(CompressionPolicy())
+        self.path = os.path.join(conversion_folder, MANIFEST_NAME)
+        self.entries: dict[str, dict] = {}
 
-class FlowStyleList(list):
-    pass
+    def load(self) -> None:
+        ''' Reads the manifest, starting over if it is missing or unreadable '''
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f).get('files', {})
+        except (OSError, ValueError, AttributeError):
+            self.entries = {}
 
+    def save(self) -> None:
+        ''' Writes the manifest next to the converted files '''
+        temp_path = f"{self.path}.tmp"
 
-class HexInt(int):
-    pass
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": CONVERTER_VERSION, "files": self.entries}, f, indent=1, sort_keys=True)
 
+        os.replace(temp_path, self.path)
 
-def represent_flow_style_list(dumper, data):
-    return dumper.represent_sequence('tag:yaml.org,2002:seq', data, flow_style=True)
+    def is_current(self, relative_path: str, input_file: str) -> bool:
+        ''' Checks whether a source archive is unchanged since it was last converted by this version '''
+        entry = self.entries.get(relative_path)
+        if entry is None or entry.get('version') != CONVERTER_VERSION:
+            return False
 
+        # Files converted before compression could be chosen kept their members as they were
+        if entry.get('compression', str(CompressionPolicy())) != self.compression:
+            return False
 
-def represent_hexint(dumper, data):
-    return dumper.represent_scalar('tag:yaml.org,2002:int', f"0x{data:X}")
+        if entry['converted'] and not os.path.exists(os.path.join(self.conversion_folder, relative_path)):
+            return False
 
+        # A file that cannot be read here is handed to a worker, which reports it like any other failed file
+        try:
+            stat = os.stat(input_file)
+            if stat.st_size != entry['size']:
+                return False
+            if stat.st_mtime_ns == entry['mtime']:
+                return True
+
+            # The file was touched, so only its contents can tell whether it changed
+            if hash_file(input_file) != entry['digest']:
+                return False
+        except OSError:
+            return False
+
+        entry['mtime'] = stat.st_mtime_ns
+        return True
+
+    def record(self, relative_path: str, result: FileResult) -> None:
+        ''' Records a successfully processed source archive '''
+        self.entries[relative_path] = {
+            "version": CONVERTER_VERSION,
+            "compression": self.compression,
+            "converted": result.converted,
+            "size": result.size,
+            "mtime": result.mtime,
+            "digest": result.digest,
+        }
 
-yaml.add_representer(FlowStyleList, represent_flow_style_list)
-yaml.add_representer(HexInt, represent_hexint)
+    def prune(self, source_paths: set[str], unread_folders: Iterable[str] = ()) -> list[str]:
+        '''
+        Deletes the converted files whose source archives are gone, returning their paths. Files under a folder
+        that could not be read are kept, since their sources may well still be there.
+        '''
+        removed: list[str] = []
+        kept_prefixes = tuple('' if folder == '.' else f"{folder}/" for folder in unread_folders)
 
+        for relative_path in [path for path in self.entries if path not in source_paths and not path.startswith(kept_prefixes)]:
+            entry = self.entries.pop(relative_path)
+            output_path = os.path.join(self.conversion_folder, relative_path)
 
-def write_metadata(folder: str, base_name: str, cosmetic_name: str, instrument_set: str | int, song_type: str, music_groups, zsounds: dict[str, dict[str, int]] = None):
-    ''' Writes the YAML .metadata file '''
-    metadata_file_path = f"{folder}/{base_name}.metadata"
+            if entry.get('converted') and os.path.exists(output_path):
+                os.remove(output_path)
+                removed.append(output_path)
 
-    yaml_dict: dict = {
-        "game": "oot",
-        "metadata": {
-            "display name": cosmetic_name,
-            "instrument set": HexInt(instrument_set) if isinstance(instrument_set, int) else instrument_set,
-            "song type": song_type,
-            "music groups": FlowStyleList([cat for cat in music_groups]),
-        }
-    }
+        return removed
 
-    if zsounds:
-        yaml_dict["metadata"]["audio samples"] = zsounds
 
-    with open(metadata_file_path, "w", encoding="utf-8") as f:
-        yaml.dump(yaml_dict, f, sort_keys=False, allow_unicode=True)
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    ''' Nearest-rank percentile of an already sorted list '''
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
 
 
-def copy_archive_files(source_dir: str, destination_dir: str) -> None:
-    ''' Copies the contents of the original archive to the folder for the new archive '''
-    skip_extensions: list[str] = ['.meta']  # Skip the old metadata file
+def summarize_timings(records: list[dict]) -> dict:
+    ''' Rolls the per-file timings up into per-stage totals and percentiles '''
+    summary: dict = {}
 
-    for file in os.listdir(source_dir):
-        name: str = os.path.basename(file)
-        extension: str = os.path.splitext(file)[1]
+    for name in ['total', *STAGES]:
+        if name == 'total':
+            timings = [(record["seconds"], record["size"]) for record in records if record["seconds"] is not None]
+        else:
+            timings = [record["stages"][name] for record in records if name in record["stages"]]
 
-        if extension.lower() in skip_extensions:
+        if not timings:
             continue
 
-        shutil.copyfile(os.path.join(source_dir, file), os.path.join(destination_dir, file))
+        seconds = sorted(seconds for seconds, _ in timings)
+        summary[name] = {
+            "files": len(timings),
+            "seconds": sum(seconds),
+            "bytes": sum(count or 0 for _, count in timings),
+            "p50": percentile(seconds, 0.50),
+            "p95": percentile(seconds, 0.95),
+            "max": seconds[-1],
+        }
 
+    return summary
 
-def pack(filename: str, tempfolder: str, destination_dir: str) -> None:
-    '''Packs the temp folder into a new .ootrs file'''
-    archive_base = os.path.join(destination_dir, filename)
-    zip_path = f"{archive_base}.zip"
-    mmrs_path = f"{archive_base}.ootrs"
 
-    shutil.make_archive(archive_base, 'zip', tempfolder)
+class RunStatistics:
+    ''' Collects the per-stage timings of every processed file for the run report '''
 
-    if os.path.exists(mmrs_path):
-        os.remove(mmrs_path)
+    def __init__(self):
+        self.records: list[dict] = []
+        self.errors: list[dict] = []
+        self.started = time.perf_counter()
 
-    os.rename(zip_path, mmrs_path)
+    def add(self, result: FileResult, directory: str) -> None:
+        if result.error is not None:
+            status = "error"
+        else:
+            status = "converted" if result.converted else "skipped"
+
+        self.records.append({
+            "file": result.input_file,
+            "directory": directory,
+            "status": status,
+            "size": result.size,
+            "seconds": result.seconds,
+            "stages": result.stages,
+            "diagnostics": result.diagnostics,
+        })
+
+    def add_error(self, record: dict) -> None:
+        self.errors.append(record)
+
+    def summarize(self) -> dict:
+        records_by_dir = defaultdict(list)
+        for record in self.records:
+            records_by_dir[record["directory"]].append(record)
+
+        slowest = sorted((record for record in self.records if record["seconds"] is not None), key=lambda record: record["seconds"], reverse=True)
+
+        return {
+            "converter_version": CONVERTER_VERSION,
+            "wall_seconds": time.perf_counter() - self.started,
+            "files": len(self.records),
+            "converted": sum(1 for record in self.records if record["status"] == "converted"),
+            "skipped": sum(1 for record in self.records if record["status"] == "skipped"),
+            "errors": len(self.errors),
+            "errors_by_stage": dict(Counter(record["stage"] or "unknown" for record in self.errors).most_common()),
+            "errors_by_exception": dict(Counter(record["exception"] for record in self.errors).most_common()),
+            "corrected": {record["file"]: record["diagnostics"] for record in self.records if record["diagnostics"]},
+            "stages": summarize_timings(self.records),
+            "directories": {directory: summarize_timings(records) for directory, records in sorted(records_by_dir.items())},
+            "slowest": slowest[:REPORT_SLOWEST_FILES],
+        }
+
+    def write_report(self, report_format: str, folder: str = None) -> str:
+        ''' Writes the JSON summary or the per-file CSV into the error log's folder, returning its path '''
+        report_path = os.path.join(folder or '', f"{REPORT_NAME}.{report_format}")
 
+        if report_format == 'json':
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump(self.summarize(), f, indent=2)
+            return report_path
 
-def process_meta_file(meta_filepath: str) -> tuple[str, str | int, str, list[str], dict]:
-    ''' Extracts data from the archive's .meta file '''
+        with open(report_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['file', 'directory', 'status', 'bytes', 'seconds',
+                             *[f"{name}_{column}" for name in STAGES for column in ('seconds', 'bytes')], 'diagnostics'])
 
-    # Expected format:
-    # Line 1: cosmetic name
-    # Line 2: instrument set
-    # Line 3: song type
-    # Line 4: music groups (comma-separated list)
-    # Line 5+: meta commands
-    with open(meta_filepath, 'r') as f:
-        lines = f.readlines()
-        lines = [line.rstrip() for line in lines]
+            for record in self.records:
+                stage_columns = []
+                for name in STAGES:
+                    stage_columns.extend(record["stages"].get(name, ('', '')))
 
-        cosmetic_name = f"{lines[0]}"
+                writer.writerow([record["file"], record["directory"], record["status"], record["size"], record["seconds"], *stage_columns,
+                                 '; '.join(record["diagnostics"])])
 
-        if lines[1] == "bgm" or lines[1] == "fanfare":
-            raise ValueError(f'process_meta_file Error: Expected instrument set for line 2, but got "{lines[1]}" instead.')
+        return report_path
 
-        instrument_set = "custom" if lines[1] == '-' else int(lines[1], 16)
 
-        if len(lines) < 3:
-            song_type = "bgm"
-        elif len(lines) >= 3:
-            song_type = lines[2].lower()
+def process_batch(batch: list[str], base_folder: str, conversion_folder: str) -> list[FileResult]:
+    ''' Processes a batch of files inside a worker and collects the outcome of each file '''
+    results: list[FileResult] = []
 
-        if len(lines) < 4:
-            music_groups = DEFAULT_BGM_CATEGORIES if song_type == "bgm" else DEFAULT_FANFARE_CATEGORIES
-        elif len(lines) >= 4:
-            music_groups = [category for category in lines[3].split(',')]
+    for input_file in batch:
+        timer = StageTimer()
+        diagnostics: list[MetaDiagnostic] = []
+        start = time.perf_counter()
 
-        zsounds = {}
-        if len(lines) >= 5:
-            for line in lines[4:]:
-                tokens = line.split(':')
+        try:
+            stat = os.stat(input_file)
+            digest = None
+            if os.path.splitext(input_file)[1] == ".ootrs":
+                with timer.stage('hash'):
+                    digest = hash_file(input_file)
+                    timer.add_bytes('hash', stat.st_size)
+
+            converted = processing_file(input_file, base_folder, conversion_folder, timer, diagnostics)
+            results.append(FileResult(input_file, converted, size=stat.st_size, mtime=stat.st_mtime_ns, digest=digest,
+                                      seconds=time.perf_counter() - start, stages=timer.as_dict(),
+                                      diagnostics=[str(diagnostic) for diagnostic in diagnostics]))
+        except Exception as e:
+            results.append(FileResult(input_file, error=str(e), trace=traceback.format_exc(),
+                                      seconds=time.perf_counter() - start, stages=timer.as_dict(),
+                                      error_type=type(root_exception(e)).__name__, failed_stage=timer.failed_stage))
 
-                # Try to parse new style, else fallback to old style
-                try:
-                    if tokens[0] == 'ZSOUND':
-                        zsounds[tokens[4]] = {
-                            "instrument type": tokens[1],
-                            "list index": int(tokens[2]),
-                            "key region": tokens[3] if tokens[3] in ("LOW", "PRIM", "HIGH") else "PRIM"
-                        }
-                except:
-                    if tokens[0] == 'ZSOUND':
-                        zsounds[tokens[1]] = {
-                            "temp address": int(tokens[2], 16)
-                        }
+    return results
 
-    return cosmetic_name, instrument_set, song_type, music_groups, zsounds
 
+def iter_music_files(base_folder: str, unreadable_folders: list[tuple[str, OSError]] = None) -> Iterator[tuple[str, list[str]]]:
+    '''
+    Walks a folder with os.scandir, yielding each directory's .ootrs files as soon as the directory is read.
 
-def convert_archive(input_file: str, destination_dir: str) -> None:
-    ''' Converts an .ootrs file into the YAML metadata .ootrs format '''
-    filename = os.path.splitext(os.path.basename(input_file))[0]
-    filepath = os.path.abspath(input_file)
+    Folders that cannot be read are skipped, and added with their error to unreadable_folders when it is given.
+    '''
+    folders: list[str] = [base_folder]
 
-    with tempfile.TemporaryDirectory(prefix='ootrs_convert_') as tempfolder:
-        archive = MusicArchive(tempfolder)
-        original_temp = archive.tempfolder
+    while folders:
+        folder = folders.pop()
+        subfolders: list[str] = []
+        archives: list[str] = []
 
         try:
-            archive.unpack(filepath)
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        # Like os.walk, do not follow links into other folders
+                        if not entry.is_symlink():
+                            subfolders.append(entry.path)
+                    elif os.path.splitext(entry.name)[1] == ".ootrs" and entry.is_file():
+                        archives.append(entry.path)
+        except OSError as e:
+            if unreadable_folders is not None:
+                unreadable_folders.append((folder, e))
+            continue
 
-            meta_name: str = os.path.splitext(os.path.basename(archive.meta))[0]
-            meta_filepath: str = os.path.join(original_temp, archive.meta)
-            cosmetic_name, instrument_set, song_type, music_groups, zsounds = process_meta_file(meta_filepath)
+        if archives:
+            yield folder, sorted(archives)
 
-            if USE_NEW_LINKING and archive.bankmeta and archive.bank:
-                with open(os.path.join(original_temp, archive.bankmeta), 'rb') as bmeta:
-                    bankmeta_data = bmeta.read()
+        # Visit subfolders in name order
+        folders.extend(sorted(subfolders, reverse=True))
 
-                with open(os.path.join(original_temp, archive.bank), 'rb') as zbank:
-                    zbank_data = zbank.read()
 
-                audiobank: Audiobank = Audiobank(bankmeta_data, zbank_data)
+def batch_files(files: Iterable[str], workers: int, max_files: int, max_bytes: int = BATCH_MAX_BYTES) -> Iterator[list[str]]:
+    ''' Groups files into batches so that small archives share a single trip to a worker '''
+    batch: list[str] = []
+    batch_bytes = 0
+    batch_count = 0
 
-                for key, value in list(zsounds.items()):
-                    if key and value and "temp address" in value:
-                        for sample in audiobank.get_bank_samples():
-                            if value['temp address'] == sample.address:
-                                zsounds[key] = {
-                                    "instrument type": sample.parent_type,
-                                    "list index": sample.parent_index
-                                }
+    for input_file in files:
+        try:
+            size = os.path.getsize(input_file)
+        except OSError:
+            size = 0
 
-                                if isinstance(sample.parent, Instrument):
-                                    zsounds[key]["key region"] = sample.key_region
+        # Batches start at one file and grow each time every worker has had one,
+        # so that a small run is still spread across all the workers
+        batch_limit = min(max_files, 1 + batch_count // workers)
 
-                                break
+        if batch and (len(batch) >= batch_limit or batch_bytes + size > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+            batch_count += 1
 
-            with tempfile.TemporaryDirectory(prefix='ootrs_convert_2_') as song_folder:
-                copy_archive_files(original_temp, song_folder)
-                # copy_unprocessed_files(original_temp, song_folder)
+        batch.append(input_file)
+        batch_bytes += size
 
-                write_metadata(song_folder, meta_name, cosmetic_name, instrument_set, song_type, music_groups, zsounds)
-                pack(f'{filename}', song_folder, destination_dir)
+    if batch:
+        yield batch
 
-        except SkipFileException:
-            return
-        except Exception as e:
-            raise Exception(e)
 
+def worker_count(workers: int = None, use_processes: bool = False) -> int:
+    ''' One worker per CPU, unless a count of at least one is given '''
+    if workers is None or workers < 1:
+        workers = os.cpu_count() or 1
 
-def processing_file(input_file: str, base_folder: str, conversion_folder: str) -> None:
-    ''' Processes a single file '''
-    try:
-        extension = os.path.splitext(input_file)[1]
-        relative_path = os.path.relpath(input_file, base_folder)
-        destination_dir = os.path.dirname(os.path.join(conversion_folder, relative_path))
+    # Windows cannot wait on more than 61 worker processes
+    if use_processes and sys.platform == 'win32':
+        workers = min(workers, 61)
 
-        # Create the destination and copy the file to the destination
-        os.makedirs(destination_dir, exist_ok=True)
+    return workers
 
-        if extension == ".ootrs":
-            convert_archive(input_file, destination_dir)
 
-    except Exception as e:
-        raise Exception(f"processing_file Error: {e}")
+def create_executor(workers: int = None, use_processes: bool = USE_PROCESS_POOL, bank_cache_folder: str = None,
+                    compression_policy: CompressionPolicy = None, map_source_archives: bool = None) -> Executor:
+    ''' Creates the worker pool, using one worker per CPU unless a count is given '''
+    workers = worker_count(workers, use_processes)
+
+    if not use_processes:
+        configure_worker(bank_cache_folder, compression_policy, map_source_archives)
+        return ThreadPoolExecutor(max_workers=workers)
+
+    # Imported here, since it loads multiprocessing, which runs on threads never need
+    from concurrent.futures import ProcessPoolExecutor
 
+    return ProcessPoolExecutor(max_workers=workers, initializer=configure_worker, initargs=(bank_cache_folder, compression_policy, map_source_archives))
 
-def process_with_spinner(input_file: str, base_folder: str, conversion_folder: str, show_file_log: bool = False) -> None:
-    ''' Processes files with the spinner '''
-    global spinner_thread
+
+def collect_batch(future: Future, batch: list[str], base_folder: str, manifest: ConversionManifest, statistics: RunStatistics = None,
+                  progress: ProgressDisplay = None) -> None:
+    ''' Reports, records and logs the outcome of every file in a finished batch '''
     try:
-        processing_file(input_file, base_folder, conversion_folder)
+        results = future.result()
     except Exception as e:
-        # Stop processing and log exceptions
-        done_flag.set()
-        spinner_thread.join()
-        print(f"{RED}Error processing {input_file}:{RESET}")
-        print(f"{YELLOW}{str(e)}{RESET}")
-        print()
-        log_error(f"Error processing {input_file}", exc_info=True)
-        # Restart processing
-        spinner_thread = start_spinner("Processing file...")
-
-
-def process_files(base_folder: str, conversion_folder: str, files: list[str], show_file_log: bool = False):
-    ''' Begins the file process across multiple threads '''
+        # The worker itself failed, so every file in its batch is lost
+        trace = ''.join(traceback.format_exception(e))
+        results = [FileResult(input_file, error=f"process_batch Error: {e}", trace=trace, error_type=type(root_exception(e)).__name__)
+                   for input_file in batch]
+
+    for result in results:
+        if statistics is not None:
+            directory = os.path.dirname(os.path.relpath(result.input_file, base_folder))
+            statistics.add(result, os.path.join(os.path.basename(base_folder), directory))
+
+        if progress is not None:
+            progress.add_result(result)
+
+        if result.diagnostics:
+            log_warning(f"Corrected {result.input_file}\n" + "\n".join(result.diagnostics))
+
+        if result.error is not None:
+            record = error_record(result)
+            log_error(f"Error processing {result.input_file}\n{result.trace.rstrip()}", exc_info=False, error_record=record)
+
+            if statistics is not None:
+                statistics.add_error(record)
+            if progress is not None:
+                progress.add_error(record)
+        elif result.digest is not None:
+            manifest.record(os.path.relpath(result.input_file, base_folder).replace(os.sep, '/'), result)
+
+
+def process_files(executor: Executor, base_folder: str, conversion_folder: str, directories: Iterable[tuple[str, list[str]]],
+                  show_file_log: bool = False, force: bool = False, prune: bool = False, statistics: RunStatistics = None,
+                  compression_policy: CompressionPolicy = None, progress: ProgressDisplay = None,
+                  unreadable_folders: list[tuple[str, OSError]] = None, workers: int = None):
+    ''' Begins the file process across the executor's workers, as the directories are found; workers is the count it was created with '''
     os.makedirs(conversion_folder, exist_ok=True)
 
-    # Store each file and its relative path
-    files_by_dir = defaultdict(list)
-    for input_file in files:
-        rel_path = os.path.relpath(input_file, base_folder)
-        dir_path = os.path.dirname(rel_path)
-        files_by_dir[dir_path].append((input_file, os.path.basename(rel_path)))
-
-    with ThreadPoolExecutor() as executor:
-        # Process files by directory
-        for dir_path, file_entries in sorted(files_by_dir.items()):
-            if not USE_SPINNER and show_file_log:
+    manifest = ConversionManifest(conversion_folder, str(compression_policy or compression))
+    if not force:
+        manifest.load()
+
+    source_paths: set[str] = set()
+
+    def files_to_convert() -> Iterator[str]:
+        ''' Leaves out archives that are already converted, printing each directory as it is reached '''
+        for _, archives in directories:
+            file_entries: list[str] = []
+
+            for input_file in archives:
+                manifest_path = os.path.relpath(input_file, base_folder).replace(os.sep, '/')
+                source_paths.add(manifest_path)
+
+                if not manifest.is_current(manifest_path, input_file):
+                    file_entries.append(input_file)
+
+            if progress is not None:
+                progress.add_total(len(file_entries))
+
+            if file_entries and not USE_SPINNER and show_file_log:
+                dir_path = os.path.dirname(os.path.relpath(file_entries[0], base_folder))
                 print(f"{CYAN}Processing Directory:{RESET} {os.path.join(os.path.basename(base_folder), dir_path)}")
 
-                for _, filename in sorted(file_entries, key=lambda x: x[1]):
-                    print(f"{GRAY_248}  └─ Processing file:{RESET} {filename}")
+                for input_file in file_entries:
+                    print(f"{GRAY_248}  └─ Processing file:{RESET} {os.path.basename(input_file)}")
+
+            yield from file_entries
+
+    # Worker processes pay for every round trip, so hand them several small archives at once
+    workers = worker_count(workers)
+    max_files = 1 if isinstance(executor, ThreadPoolExecutor) else BATCH_MAX_FILES
+
+    # Only a few batches per worker are queued at once, so memory stays flat however large the library is
+    max_pending = workers * PENDING_BATCHES_PER_WORKER
+    pending: dict[Future, list[str]] = {}
+
+    try:
+        for batch in batch_files(files_to_convert(), workers, max_files):
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect_batch(future, pending.pop(future), base_folder, manifest, statistics, progress)
+
+            pending[executor.submit(process_batch, batch, base_folder, conversion_folder)] = batch
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                collect_batch(future, pending.pop(future), base_folder, manifest, statistics, progress)
+
+        unread_folders: list[str] = []
+        for folder, e in unreadable_folders or []:
+            record = {"path": folder, "stage": "walk", "exception": type(e).__name__, "message": f"iter_music_files Error: {e}"}
+            log_error(f"Error reading folder {folder}: {e}", exc_info=False, error_record=record)
+
+            if statistics is not None:
+                statistics.add_error(record)
+            if progress is not None:
+                progress.add_error(record)
+            unread_folders.append(os.path.relpath(folder, base_folder).replace(os.sep, '/'))
+
+        # Only a whole folder shows which sources were deleted
+        if prune:
+            for removed_path in manifest.prune(source_paths, unread_folders):
+                if not USE_SPINNER:
+                    print(f"{GRAY_248}  └─ Removed file:{RESET} {os.path.relpath(removed_path, conversion_folder)}")
+
+    finally:
+        manifest.save()
+
+
+def collect_music_files(files: list[str]) -> list[str]:
+    ''' Lists the .ootrs files given on the command line and inside the folders given '''
+    paths: list[str] = []
+    for file in files:
+        if os.path.isdir(file):
+            unreadable_folders: list[tuple[str, OSError]] = []
+            for folder, archives in iter_music_files(os.path.abspath(file), unreadable_folders):
+                paths.extend(archives)
+
+            for folder, e in unreadable_folders:
+                print(f"{RED}Error reading folder {folder}:{RESET}\n{YELLOW}{e}{RESET}")
+        elif os.path.isfile(file) and os.path.splitext(file)[1] == ".ootrs":
+            paths.append(os.path.abspath(file))
+
+    return paths
+
+
+def scan_music_files(files: list[str], workers: int = None, report_format: str = 'json') -> dict[str, int]:
+    ''' Inventories archives from their zip central directories alone, without converting or decompressing anything '''
+    paths = collect_music_files(files)
+
+    counts = {status: 0 for status in (SCAN_CONVERTIBLE, SCAN_CONVERTED, SCAN_INCOMPLETE, SCAN_MALFORMED)}
+    records: list[dict] = []
+
+    # Reading a central directory is mostly waiting on the disk, so threads are enough
+    with ThreadPoolExecutor(worker_count(workers)) as executor:
+        for path, scan in zip(paths, executor.map(scan_file, paths)):
+            counts[scan.status] += 1
+            records.append({"file": path, **scan.as_dict()})
+
+            if scan.status in (SCAN_INCOMPLETE, SCAN_MALFORMED):
+                print(f"{RED}{scan.status.capitalize()}:{RESET} {path}: {scan.reason}")
+
+    report_path = f"{SCAN_NAME}.{report_format}"
+    if report_format == 'json':
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump({"files": len(records), **counts, "archives": records}, f, indent=2)
+    else:
+        with open(report_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(records[0]) if records else ['file'])
+            writer.writeheader()
+            writer.writerows(records)
+
+    print(f"{GRAY_245}Scanned {len(records)} files: {counts[SCAN_CONVERTIBLE]} to convert, {counts[SCAN_CONVERTED]} already converted, "
+          f"{counts[SCAN_INCOMPLETE]} incomplete, {counts[SCAN_MALFORMED]} malformed. Inventory written to {report_path}{RESET}")
+
+    return counts
+
+
+def analyze_music_banks(files: list[str], workers: int = None, use_processes: bool = USE_PROCESS_POOL) -> 'BankTable':
+    ''' Reads every archive's bank into one table, then writes its samples and the library-wide findings '''
+    from utils.BankTable import BankTable, read_archive_banks
+
+    paths = collect_music_files(files)
+    batches = [paths[i:i + BATCH_MAX_FILES] for i in range(0, len(paths), BATCH_MAX_FILES)]
+    table = BankTable()
+
+    with create_executor(workers, use_processes) as executor:
+        for batch_table, errors in executor.map(read_archive_banks, batches):
+            table.extend(batch_table)
+            for path, error in errors:
+                print(f"{RED}Error reading {path}:{RESET}\n{YELLOW}{error}{RESET}")
+
+    summary = table.summarize()
+    with open(f"{BANKS_NAME}.json", 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    table.write_csv(f"{BANKS_NAME}.csv")
+
+    print(f"{GRAY_245}Read {len(table)} samples from {len(table.archives)} archives: {len(summary['custom_instrument_sets'])} custom instrument sets, "
+          f"{len(summary['shared_addresses'])} sample addresses shared between archives, {len(summary['empty_tables'])} empty drum or sound effect tables. "
+          f"Written to {BANKS_NAME}.json and {BANKS_NAME}.csv{RESET}")
+
+    return table
+
+
+def parse_arguments(argv: list[str] = None) -> argparse.Namespace:
+    ''' Reads the command line; dragging files onto the script passes them as plain arguments '''
+    parser = argparse.ArgumentParser(description="Converts .ootrs music files to the YAML metadata .ootrs format.")
+    parser.add_argument('files', nargs='*', help="folders or .ootrs files to convert")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="number of workers to convert with (default: CPU count)")
+    parser.add_argument('--threads', action='store_true', help="convert with worker threads instead of worker processes")
+    parser.add_argument('--force', action='store_true', help="convert every file again, even if it is unchanged since the last run")
+    parser.add_argument('--bank-cache', metavar='FOLDER', help="keep parsed banks in this folder so later runs can reuse them")
+    parser.add_argument('--report', choices=['json', 'csv'], help=f"write per-stage timings to {REPORT_NAME}.json or .csv, next to the error logs")
+    parser.add_argument('--mmap', action='store_true', default=MAP_SOURCE_ARCHIVES,
+                        help="memory-map the files being converted, so stored members are read from the page cache instead of copied")
+    parser.add_argument('--scan', action='store_true', help=f"only list what each archive holds and whether it can be converted, in {SCAN_NAME}.json or .csv")
+    parser.add_argument('--analyze-banks', action='store_true',
+                        help=f"only read every bank into one table, writing its samples to {BANKS_NAME}.csv and shared addresses, custom sets and empty tables to {BANKS_NAME}.json")
+    parser.add_argument('--log-folder', metavar='FOLDER', help=f"write {ERROR_LOG_NAME}.log and .jsonl to this folder (default: current folder)")
+    parser.add_argument('--compress', action='append', default=[], metavar='[.EXT=]METHOD[:LEVEL]',
+                        help="how to compress members, for one type or all of them: keep, auto, store, deflate, bzip2 or lzma (repeatable)")
+
+    args = parser.parse_args(argv)
+
+    try:
+        args.compression = CompressionPolicy.parse(args.compress, 'keep' if RAW_COPY_MEMBERS else 'deflate')
+    except ValueError as e:
+        parser.error(str(e))
 
-            for input_file, _, in file_entries:
-                executor.submit(process_with_spinner, input_file, base_folder, conversion_folder, show_file_log)
+    return args
 
 
-def convert_music_files() -> None:
+def convert_music_files(files: list[str], workers: int = None, use_processes: bool = USE_PROCESS_POOL, force: bool = False,
+                        report_format: str = None, bank_cache_folder: str = None, compression_policy: CompressionPolicy = None,
+                        log_folder: str = None, map_source_archives: bool = MAP_SOURCE_ARCHIVES) -> None:
     ''' Main function to process files and convert them from the old format to the new format '''
-    global spinner_thread
+    statistics = RunStatistics()
+    compression_policy = compression_policy or compression
+
+    # A single file is converted on a thread, since starting worker processes would take longer than the conversion
+    if len(files) == 1 and os.path.isfile(files[0]):
+        workers, use_processes = 1, False
+    workers = worker_count(workers, use_processes)
 
-    spinner_thread = start_spinner("Processing files...")
+    error_log = ErrorLog(log_folder)
+    error_log.start()
+    progress = ProgressDisplay()
+    progress.start()
 
     try:
-        for file in FILES:
-            filepath = os.path.abspath(file)
-
-            # If the file is a directory, process the directory and all subdirectories
-            if os.path.isdir(file):
-                base_folder = filepath
-                parent_folder = os.path.dirname(base_folder)
-                conversion_folder: str = os.path.join(parent_folder, f'{os.path.basename(base_folder)}_converted')
-
-                # Build the list of files in the directory and each subdirectory
-                files_to_process = [
-                    os.path.join(root, name)
-                    for root, _, files in os.walk(base_folder)
-                    for name in files
-                ]
+        with create_executor(workers, use_processes, bank_cache_folder, compression_policy, map_source_archives) as executor:
+            for file in files:
+                filepath = os.path.abspath(file)
 
-                if not USE_SPINNER:
-                    print(f"{CYAN}Processing directory:{RESET} {os.path.basename(base_folder)}")
+                # If the file is a directory, process the directory and all subdirectories
+                if os.path.isdir(file):
+                    base_folder = filepath
+                    parent_folder = os.path.dirname(base_folder)
+                    conversion_folder: str = os.path.join(parent_folder, f'{os.path.basename(base_folder)}_converted')
 
-                process_files(base_folder, conversion_folder, files_to_process, True)
+                    if not USE_SPINNER:
+                        print(f"{CYAN}Processing directory:{RESET} {os.path.basename(base_folder)}")
 
-            # If the file is a single file, process just the single file
-            elif os.path.isfile(file):
-                base_folder = os.path.dirname(filepath)
-                conversion_folder: str = os.path.join(base_folder, 'converted_files')
+                    # Files are handed to the workers while the directory and each subdirectory are still being read
+                    unreadable_folders: list[tuple[str, OSError]] = []
+                    process_files(executor, base_folder, conversion_folder, iter_music_files(base_folder, unreadable_folders), True,
+                                  force=force, prune=True, statistics=statistics, compression_policy=compression_policy, progress=progress,
+                                  unreadable_folders=unreadable_folders, workers=workers)
 
-                if not USE_SPINNER:
-                    print(f"{CYAN}Processing File:{RESET} {os.path.basename(file)}")
+                # If the file is a single file, process just the single file
+                elif os.path.isfile(file):
+                    base_folder = os.path.dirname(filepath)
+                    conversion_folder: str = os.path.join(base_folder, 'converted_files')
+
+                    if not USE_SPINNER:
+                        print(f"{CYAN}Processing File:{RESET} {os.path.basename(file)}")
 
-                process_files(base_folder, conversion_folder, [file])
+                    archives = [filepath] if os.path.splitext(filepath)[1] == ".ootrs" else []
+                    process_files(executor, base_folder, conversion_folder, [(base_folder, archives)], force=force, statistics=statistics,
+                                  compression_policy=compression_policy, progress=progress, workers=workers)
+
+        if report_format is not None:
+            statistics.write_report(report_format, error_log.folder)
 
     finally:
-        done_flag.set()
-        spinner_thread.join()
-        if USE_SPINNER:
-            sys.stdout.write(f"{PL}{CL}{GREEN_79}✓{RESET} {GRAY_245}All files processed.{RESET}\n")
-        else:
-            sys.stderr.write(f"{GREEN_79}✓{RESET} {GRAY_245}All files processed.{RESET}\n")
-        sys.stdout.flush()
+        error_log.stop()
+        progress.stop(error_log.records_path)
+
+
+def main(argv: list[str] = None) -> None:
+    ''' Runs the mode the command line asks for '''
+    args = parse_arguments(argv)
+    if args.scan:
+        scan_music_files(args.files, args.workers, args.report or 'json')
+    elif args.analyze_banks:
+        analyze_music_banks(args.files, args.workers, not args.threads)
+    else:
+        convert_music_files(args.files, args.workers, not args.threads, args.force, args.report, args.bank_cache, args.compression,
+                            args.log_folder, args.mmap)
+
+    # Keeps the window of a drag-and-drop run open, without leaving programs that call the script waiting on a key press
+    if sys.platform == 'win32' and sys.stdin is not None and sys.stdin.isatty():
+        os.system('pause')
 
 
 if __name__ == '__main__':
-    convert_music_files()
-    os.system('pause')
+    main()
@@ -0,0 +1,288 @@
+'''
+Measures conversion throughput on a synthetic corpus of legacy .ootrs archives.
+
+Usage:
+    python benchmarks/benchmark.py [options] [--output results.json]
+
+Each stage is timed on its own, followed by an end-to-end run of convert_music_files, and the results
+are written as JSON so that runs from different versions can be compared. Every stage runs in a fresh
+process, since the peak memory a process reports covers its whole life.
+'''
+import argparse
+import contextlib
+import glob
+import importlib.util
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+from corpus import CorpusOptions, generate_corpus
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UPDATER_PATH = os.path.join(REPO_ROOT, 'OOTR Music Updater.py')
+
+# Stages in the order they are run and reported
+STAGE_NAMES: list[str] = [
+    'process_meta_file', 'audiobank', 'write_metadata', 'pack', 'pack_store', 'pack_auto', 'pack_deflate',
+    'convert_archive', 'convert_archive_mmap', 'convert_bytes', 'convert_music_files',
+]
+
+
+def load_updater():
+    ''' Imports the updater script, whose file name is not a valid module name '''
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+    spec = importlib.util.spec_from_file_location('ootr_music_updater', UPDATER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    # Registered so that worker processes can find the functions they are sent
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+
+    return module
+
+
+# Loaded at import time so that spawned worker processes, which import this file, load it as well
+updater = load_updater()
+
+from utils import Converter as converter
+from utils.Audiobank import Audiobank
+
+
+def peak_rss_kb(children: bool = False) -> int | None:
+    ''' Returns the peak resident set size in KiB, or None where the platform cannot report it '''
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, everything else reports KiB
+    return usage // 1024 if sys.platform == 'darwin' else usage
+
+
+def measure(stage, repeat: int, files: int) -> dict:
+    ''' Runs a stage several times and reports its best time, throughput and the peak memory of its process '''
+    timings: list[float] = []
+    processed_bytes = 0
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        processed_bytes = stage()
+        timings.append(time.perf_counter() - start)
+
+    best = min(timings)
+    return {
+        "seconds": best,
+        "mean_seconds": sum(timings) / len(timings),
+        "files": files,
+        "bytes": processed_bytes,
+        "files_per_second": files / best if best else None,
+        "mb_per_second": processed_bytes / (1024 * 1024) / best if best else None,
+        "peak_rss_kb": peak_rss_kb(),
+        "peak_rss_children_kb": peak_rss_kb(children=True),
+    }
+
+
+def load_inputs(paths: list[str]) -> list[dict]:
+    ''' Reads the members every stage needs up front, so that the stages only time their own work '''
+    inputs: list[dict] = []
+
+    for path in paths:
+        with zipfile.ZipFile(path) as zip_archive:
+            archive = converter.MusicArchive(zip_archive)
+            archive.read_members()
+
+            entry = {
+                "path": path,
+                "size": os.path.getsize(path),
+                "meta_name": os.path.splitext(archive.meta)[0],
+                "meta": zip_archive.read(archive.meta).decode(),
+                "bankmeta": zip_archive.read(archive.bankmeta) if archive.bankmeta else None,
+                "bank": zip_archive.read(archive.bank) if archive.bank else None,
+            }
+
+        entry["parsed"] = converter.process_meta_file(io.StringIO(entry["meta"]))
+        inputs.append(entry)
+
+    return inputs
+
+
+def bench_process_meta_file(inputs: list[dict]) -> int:
+    for entry in inputs:
+        converter.process_meta_file(io.StringIO(entry["meta"]))
+    return sum(len(entry["meta"]) for entry in inputs)
+
+
+def bench_audiobank(inputs: list[dict]) -> int:
+    processed_bytes = 0
+
+    for entry in inputs:
+        if entry["bank"] is None:
+            continue
+
+        audiobank = Audiobank(entry["bankmeta"], entry["bank"])
+        for value in entry["parsed"][4].values():
+            if "temp address" in value:
+                audiobank.find_sample(value["temp address"])
+
+        processed_bytes += len(entry["bank"])
+
+    return processed_bytes
+
+
+def bench_write_metadata(inputs: list[dict]) -> int:
+    processed_bytes = 0
+
+    for entry in inputs:
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as new_archive:
+            converter.write_metadata(new_archive, entry["meta_name"], *entry["parsed"])
+            processed_bytes += new_archive.getinfo(f"{entry['meta_name']}.metadata").file_size
+
+    return processed_bytes
+
+
+def bench_pack(inputs: list[dict], output_folder: str, compression: str = 'keep') -> int:
+    os.makedirs(output_folder, exist_ok=True)
+    policy = converter.CompressionPolicy(compression)
+
+    for i, entry in enumerate(inputs):
+        with zipfile.ZipFile(entry["path"]) as zip_archive, converter.pack(f"packed_{i}", output_folder) as new_archive:
+            converter.copy_archive_files(zip_archive, new_archive, policy)
+
+    return sum(entry["size"] for entry in inputs)
+
+
+def bench_convert_archive(inputs: list[dict], output_folder: str, map_archive: bool = False) -> int:
+    os.makedirs(output_folder, exist_ok=True)
+
+    for entry in inputs:
+        converter.convert_archive(entry["path"], output_folder, map_archive=map_archive)
+
+    return sum(entry["size"] for entry in inputs)
+
+
+def bench_convert_bytes(inputs: list[dict]) -> int:
+    archives = []
+    for entry in inputs:
+        with open(entry["path"], 'rb') as f:
+            archives.append((entry["path"], f.read()))
+
+    for result in converter.iter_convert_bytes(archives):
+        if result.error is not None:
+            raise result.error
+
+    return sum(entry["size"] for entry in inputs)
+
+
+def bench_convert_music_files(corpus_folder: str, corpus_bytes: int, workers: int, use_processes: bool) -> int:
+    conversion_folder = f"{corpus_folder}_converted"
+    if os.path.exists(conversion_folder):
+        shutil.rmtree(conversion_folder)
+
+    # The progress display would otherwise end up in the JSON written to stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        updater.convert_music_files([corpus_folder], workers, use_processes, force=True)
+
+    return corpus_bytes
+
+
+def parse_arguments(argv: list[str] = None) -> argparse.Namespace:
+    defaults = CorpusOptions()
+
+    parser = argparse.ArgumentParser(description="Benchmarks the .ootrs converter on a synthetic corpus.")
+    parser.add_argument('--files', type=int, default=defaults.files, help="number of archives to generate")
+    parser.add_argument('--seq-size', type=int, default=defaults.seq_size, help="size of each .seq in bytes")
+    parser.add_argument('--instruments', type=int, default=defaults.instruments, help="instruments per bank")
+    parser.add_argument('--drums', type=int, default=defaults.drums, help="drums per bank")
+    parser.add_argument('--effects', type=int, default=defaults.effects, help="sound effects per bank")
+    parser.add_argument('--zsounds', type=int, default=defaults.zsounds, help=".zsound files per archive")
+    parser.add_argument('--zsound-size', type=int, default=defaults.zsound_size, help="size of each .zsound in bytes")
+    parser.add_argument('--old-style-ratio', type=float, default=defaults.old_style_ratio, help="share of ZSOUND lines using temp addresses")
+    parser.add_argument('--seed', type=int, default=defaults.seed, help="seed for the corpus generator")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per stage, the best one is reported")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="workers for the end-to-end run (default: CPU count)")
+    parser.add_argument('--threads', action='store_true', help="use worker threads for the end-to-end run")
+    parser.add_argument('--output', help="write the JSON results to this file instead of stdout")
+    # Used by the benchmark itself to run one stage on a corpus it has already written
+    parser.add_argument('--stage', choices=STAGE_NAMES, help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+
+    return parser.parse_args(argv)
+
+
+def run_stage(name: str, workdir: str, repeat: int, workers: int, use_processes: bool) -> dict:
+    ''' Times one stage on the corpus in workdir; only called in the stage's own process '''
+    corpus_folder = os.path.join(workdir, 'corpus')
+    paths = sorted(glob.glob(os.path.join(corpus_folder, '*', '*.ootrs')))
+    corpus_bytes = sum(os.path.getsize(path) for path in paths)
+    inputs = load_inputs(paths)
+
+    stages = {
+        "process_meta_file": lambda: bench_process_meta_file(inputs),
+        "audiobank": lambda: bench_audiobank(inputs),
+        "write_metadata": lambda: bench_write_metadata(inputs),
+        "pack": lambda: bench_pack(inputs, os.path.join(workdir, 'packed')),
+        "pack_store": lambda: bench_pack(inputs, os.path.join(workdir, 'packed'), 'store'),
+        "pack_auto": lambda: bench_pack(inputs, os.path.join(workdir, 'packed'), 'auto'),
+        "pack_deflate": lambda: bench_pack(inputs, os.path.join(workdir, 'packed'), 'deflate'),
+        "convert_archive": lambda: bench_convert_archive(inputs, os.path.join(workdir, 'converted')),
+        "convert_archive_mmap": lambda: bench_convert_archive(inputs, os.path.join(workdir, 'converted'), True),
+        "convert_bytes": lambda: bench_convert_bytes(inputs),
+        "convert_music_files": lambda: bench_convert_music_files(corpus_folder, corpus_bytes, workers, use_processes),
+    }
+
+    return measure(stages[name], repeat, len(paths))
+
+
+def main(argv: list[str] = None) -> None:
+    args = parse_arguments(argv)
+    if args.stage is not None:
+        json.dump(run_stage(args.stage, args.workdir, args.repeat, args.workers, not args.threads), sys.stdout)
+        return
+
+    options = CorpusOptions(
+        files=args.files, seq_size=args.seq_size, instruments=args.instruments, drums=args.drums, effects=args.effects,
+        zsounds=args.zsounds, zsound_size=args.zsound_size, old_style_ratio=args.old_style_ratio, seed=args.seed,
+    )
+
+    with tempfile.TemporaryDirectory(prefix='ootrs_benchmark_') as workdir:
+        corpus_folder = os.path.join(workdir, 'corpus')
+        paths = generate_corpus(corpus_folder, options)
+        corpus_bytes = sum(os.path.getsize(path) for path in paths)
+        stage_arguments = ['--workdir', workdir, '--repeat', str(args.repeat), *(['-j', str(args.workers)] if args.workers else []),
+                           *(['--threads'] if args.threads else [])]
+
+        stages: dict[str, dict] = {}
+        for name in STAGE_NAMES:
+            stage = subprocess.run([sys.executable, os.path.abspath(__file__), '--stage', name, *stage_arguments],
+                                   stdout=subprocess.PIPE, text=True, check=True)
+            stages[name] = json.loads(stage.stdout)
+
+        results = {
+            "converter_version": converter.CONVERTER_VERSION,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "corpus": {**options.as_dict(), "bytes": corpus_bytes},
+            "stages": stages,
+        }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+'''
+Generates synthetic legacy .ootrs archives for benchmarking the converter.
+
+Every archive holds a random .seq, and optionally a custom .zbank/.bankmeta pair with .zsound files
+whose ZSOUND meta lines use either the old temp address style or the new instrument type style.
+'''
+import os
+import random
+import struct
+import zipfile
+from typing import Final
+
+
+INSTRUMENT_SIZE: Final[int] = 0x20
+DRUM_SIZE: Final[int]       = 0x10
+EFFECT_SIZE: Final[int]     = 0x8
+SAMPLE_SIZE: Final[int]     = 0x10
+
+KEY_REGIONS: Final[list[str]] = ["LOW", "PRIM", "HIGH"]
+
+
+class CorpusOptions:
+    ''' Shape of the generated archives '''
+
+    def __init__(self, files: int = 200, seq_size: int = 32 * 1024, instruments: int = 32, drums: int = 16, effects: int = 16,
+                 zsounds: int = 4, zsound_size: int = 64 * 1024, old_style_ratio: float = 0.5, folders: int = 4, seed: int = 0):
+        self.files = files
+        self.seq_size = seq_size
+        self.instruments = instruments
+        self.drums = drums
+        self.effects = effects
+        self.zsounds = zsounds
+        self.zsound_size = zsound_size
+        self.old_style_ratio = old_style_ratio
+        self.folders = folders
+        self.seed = seed
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def build_bank(num_instruments: int, num_drums: int, num_effects: int, rng: random.Random) -> tuple[bytes, bytes, list[tuple[str, int, str, int]]]:
+    ''' Builds a .zbank/.bankmeta pair and returns it with the (type, index, key region, address) of every sample '''
+    samples: list[tuple[str, int, str, int]] = []
+
+    for i in range(num_instruments):
+        for key_region in KEY_REGIONS:
+            if key_region == "PRIM" or rng.random() < 0.5:
+                samples.append(("INST", i, key_region, 0))
+    for i in range(num_drums):
+        samples.append(("DRUM", i, None, 0))
+    for i in range(num_effects):
+        samples.append(("SFX", i, None, 0))
+
+    # Give every sample a distinct 16-byte aligned address
+    addresses = rng.sample(range(0, 1 << 20), len(samples))
+    samples = [(kind, index, key_region, address << 4) for (kind, index, key_region, _), address in zip(samples, addresses)]
+
+    instrument_base = 0x8 + (0x4 * num_instruments)
+    drum_base = instrument_base + (INSTRUMENT_SIZE * num_instruments)
+    drumlist_offset = drum_base + (DRUM_SIZE * num_drums)
+    sfxlist_offset = drumlist_offset + (0x4 * num_drums)
+    sample_base = sfxlist_offset + (EFFECT_SIZE * num_effects)
+
+    bank = bytearray(sample_base + (SAMPLE_SIZE * len(samples)))
+    struct.pack_into('>2I', bank, 0, drumlist_offset, sfxlist_offset)
+
+    for sample_index, (kind, index, key_region, address) in enumerate(samples):
+        sample_offset = sample_base + (SAMPLE_SIZE * sample_index)
+        struct.pack_into('>I', bank, sample_offset + 4, address)
+
+        match kind:
+            case "INST":
+                instrument_offset = instrument_base + (INSTRUMENT_SIZE * index)
+                struct.pack_into('>I', bank, 0x8 + (0x4 * index), instrument_offset)
+                struct.pack_into('>I', bank, instrument_offset + 8 * (KEY_REGIONS.index(key_region) + 1), sample_offset)
+            case "DRUM":
+                drum_offset = drum_base + (DRUM_SIZE * index)
+                struct.pack_into('>I', bank, drumlist_offset + (0x4 * index), drum_offset)
+                struct.pack_into('>I', bank, drum_offset + 4, sample_offset)
+            case "SFX":
+                struct.pack_into('>I', bank, sfxlist_offset + (EFFECT_SIZE * index), sample_offset)
+
+    bankmeta = struct.pack('>6BH', 0, 2, 0, 0x30, num_instruments, num_drums, num_effects)
+
+    return bytes(bank), bankmeta, samples
+
+
+def build_archive(path: str, name: str, options: CorpusOptions, rng: random.Random) -> None:
+    ''' Writes a single legacy .ootrs archive '''
+    custom = options.instruments + options.drums + options.effects > 0
+    lines = [f"{name}", "-" if custom else "0", "bgm", "Fields,Town,Dungeon"]
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(f"{name}.seq", rng.randbytes(options.seq_size))
+
+        if custom:
+            bank, bankmeta, samples = build_bank(options.instruments, options.drums, options.effects, rng)
+            archive.writestr(f"{name}.zbank", bank)
+            archive.writestr(f"{name}.bankmeta", bankmeta)
+
+            for i in range(options.zsounds):
+                zsound_name = f"Sample{i}.zsound"
+                archive.writestr(zsound_name, rng.randbytes(options.zsound_size))
+
+                kind, index, key_region, address = rng.choice(samples)
+                if rng.random() < options.old_style_ratio:
+                    lines.append(f"ZSOUND:{zsound_name}:{address:X}")
+                else:
+                    lines.append(f"ZSOUND:{kind}:{index}:{key_region or 'PRIM'}:{zsound_name}")
+
+        archive.writestr(f"{name}.meta", "\n".join(lines) + "\n")
+
+
+def generate_corpus(folder: str, options: CorpusOptions) -> list[str]:
+    ''' Writes the corpus into the folder, spread over subfolders, and returns the archive paths '''
+    rng = random.Random(options.seed)
+    paths: list[str] = []
+
+    for i in range(options.files):
+        subfolder = os.path.join(folder, f"pack_{i % max(1, options.folders)}")
+        os.makedirs(subfolder, exist_ok=True)
+
+        path = os.path.join(subfolder, f"song_{i:05}.ootrs")
+        build_archive(path, f"Song {i}", options, rng)
+        paths.append(path)
+
+    return paths
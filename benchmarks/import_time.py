@@ -0,0 +1,110 @@
+'''
+Measures how long the updater takes to start, and checks that it leaves the heavy modules unloaded until a mode needs them.
+
+Usage:
+    python benchmarks/import_time.py [--repeat 20] [--output results.json]
+
+Every run starts a fresh interpreter, so the times include everything a caller converting one file at a
+time pays for. The script exits with an error if importing the updater loads any module in LAZY_MODULES.
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UPDATER_PATH = os.path.join(REPO_ROOT, 'OOTR Music Updater.py')
+
+# Modules the updater only imports in the modes that use them
+LAZY_MODULES: list[str] = ['yaml', 'multiprocessing', 'logging.handlers', 'utils.BankTable', 'numpy', 'unicodedata']
+
+# Imports the updater the way load_updater in benchmark.py does, then lists the lazy modules that were loaded anyway
+IMPORT_UPDATER = f'''
+import importlib.util, json, sys
+sys.path.insert(0, {REPO_ROOT!r})
+spec = importlib.util.spec_from_file_location('ootr_music_updater', {UPDATER_PATH!r})
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+print(json.dumps([name for name in {LAZY_MODULES!r} if name in sys.modules]))
+'''
+
+
+def time_command(command: list[str], repeat: int, cwd: str) -> dict:
+    ''' Runs a command in a fresh interpreter several times and reports its best and mean wall time '''
+    timings: list[float] = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start)
+
+    return {"ms": min(timings) * 1000, "mean_ms": sum(timings) / len(timings) * 1000}
+
+
+def slowest_imports(count: int) -> list[dict]:
+    ''' Reads -X importtime for one import of the updater, returning the modules that took longest on their own '''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', IMPORT_UPDATER], capture_output=True, text=True, check=True)
+    imports: list[dict] = []
+
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append({"module": name.strip(), "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000})
+
+    return sorted(imports, key=lambda entry: entry["self_ms"], reverse=True)[:count]
+
+
+def parse_arguments(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmarks the updater's startup time.")
+    parser.add_argument('--repeat', type=int, default=20, help="runs per command, the best one is reported")
+    parser.add_argument('--slowest', type=int, default=10, help="number of slowest imports to list")
+    parser.add_argument('--output', help="write the JSON results to this file instead of stdout")
+
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] = None) -> int:
+    args = parse_arguments(argv)
+
+    loaded = json.loads(subprocess.run([sys.executable, '-c', IMPORT_UPDATER], capture_output=True, text=True, check=True).stdout)
+
+    # Run from an empty folder, so that nothing the modes write ends up in the repository
+    with tempfile.TemporaryDirectory(prefix='ootrs_import_time_') as workdir:
+        commands = {
+            "interpreter": [sys.executable, '-c', 'pass'],
+            "import": [sys.executable, '-c', IMPORT_UPDATER],
+            "help": [sys.executable, UPDATER_PATH, '--help'],
+            "convert_nothing": [sys.executable, UPDATER_PATH],
+            "scan_nothing": [sys.executable, UPDATER_PATH, '--scan'],
+        }
+        startup = {name: time_command(command, args.repeat, workdir) for name, command in commands.items()}
+
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "startup": startup,
+        "slowest_imports": slowest_imports(args.slowest),
+        "eagerly_loaded": loaded,
+    }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    if loaded:
+        print(f"Importing the updater loaded {', '.join(loaded)}, which should wait for the modes that use them", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+'''
+Checks that the fast .metadata emitter writes exactly what yaml.dump writes, and that it loads back the same.
+
+Usage:
+    python benchmarks/verify_metadata.py [--cases 5000] [--seed 0]
+'''
+import argparse
+import random
+import sys
+
+import yaml
+
+from benchmark import converter
+
+
+# Ordinary song names that take the fast path
+PLAIN_STRINGS: list[str] = [
+    "Zelda's Lullaby", "Gerudo Valley (Remix)", "Pokémon Center", "日本の歌", "Mega Man X2 - Boss", "A&B", "Oh!", "c+d/e",
+]
+
+# Awkward strings that need quoting, folding or escaping
+AWKWARD_STRINGS: list[str] = [
+    "", " leading", "trailing ", "yes", "No", "null", "~", "1", "0x1F", "1e3", "2.0", "- dash", "key: value", "# hash",
+    "a, b", "[bracket]", "{brace}", "'quoted'", '"double"', "tab\there", "line\nbreak", "emoji 😀", "bom﻿",
+    "next\x85line", "line\u2028separator", "paragraph\u2029separator",
+    # libyaml folds the separators as line breaks, which only shows once a line is long enough to fold
+    "Song " + "a" * 57 + "\u2028 x", "Song " + "a" * 57 + "\u2029 x", "x" * 90, " ".join(["word"] * 30),
+]
+
+
+def pick_string(rng: random.Random) -> str:
+    return rng.choice(AWKWARD_STRINGS if rng.random() < 0.1 else PLAIN_STRINGS)
+
+
+def build_metadata(rng: random.Random) -> dict:
+    ''' Builds a .metadata dictionary the same way write_metadata does '''
+    def text() -> str:
+        return " ".join(pick_string(rng) for _ in range(rng.randrange(1, 4)))
+
+    yaml_dict = {
+        "game": "oot",
+        "metadata": {
+            "display name": text(),
+            "instrument set": converter.HexInt(rng.randrange(-1, 0x40)) if rng.random() < 0.5 else rng.choice(["custom", text()]),
+            "song type": rng.choice(["bgm", "fanfare", text()]),
+            "music groups": converter.FlowStyleList(pick_string(rng) for _ in range(rng.randrange(0, 10))),
+        }
+    }
+
+    if rng.random() < 0.7:
+        zsounds = {}
+        for _ in range(rng.randrange(1, 5)):
+            if rng.random() < 0.2:
+                zsounds[f"{text()}.zsound"] = {"temp address": rng.randrange(0, 1 << 32)}
+            else:
+                zsounds[f"{text()}.zsound"] = {
+                    "instrument type": rng.choice(["INST", "DRUM", "SFX"]),
+                    "list index": rng.randrange(0, 256),
+                    "key region": rng.choice(["LOW", "PRIM", "HIGH"]),
+                }
+        yaml_dict["metadata"]["audio samples"] = zsounds
+
+    return yaml_dict
+
+
+def verify(cases: int, seed: int) -> tuple[str | None, int]:
+    ''' Checks random metadata files, returning what went wrong with the first one that fails and how many took the fast path '''
+    rng = random.Random(seed)
+    fast_cases = 0
+
+    # yaml.dump only knows HexInt and FlowStyleList once the converter has set PyYAML up
+    converter.load_yaml()
+
+    for case in range(cases):
+        yaml_dict = build_metadata(rng)
+        expected = yaml.dump(yaml_dict, sort_keys=False, allow_unicode=True)
+        actual = converter.dump_metadata(yaml_dict)
+
+        if actual != expected:
+            return f"Case {case}: output differs from yaml.dump\n--- expected\n{expected}--- actual\n{actual}", fast_cases
+        if yaml.safe_load(actual) != yaml.safe_load(expected):
+            return f"Case {case}: output does not load back the same\n{actual}", fast_cases
+
+        if converter.emit_metadata(yaml_dict) is not None:
+            fast_cases += 1
+
+    return None, fast_cases
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Verifies the fast .metadata emitter against yaml.dump.")
+    parser.add_argument('--cases', type=int, default=5000, help="number of random metadata files to check")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the random metadata")
+    args = parser.parse_args(argv)
+
+    error, fast_cases = verify(args.cases, args.seed)
+    if error is not None:
+        print(error, file=sys.stderr)
+        return 1
+
+    print(f"{args.cases} metadata files match yaml.dump ({fast_cases} took the fast path)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,22 @@
+import os
+import sys
+import unittest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks'))
+
+from verify_metadata import verify
+
+
+class MetadataTest(unittest.TestCase):
+
+    def test_metadata_matches_yaml_dump(self):
+        # A fixed seed keeps failures reproducible with benchmarks/verify_metadata.py --seed 0
+        error, fast_cases = verify(cases=500, seed=0)
+        self.assertIsNone(error, error)
+        self.assertGreater(fast_cases, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import asyncio
+import io
+import os
+import sys
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.Service import (
+    MAX_ARCHIVE_SIZE, MAX_NAME_LENGTH, REQUEST_HEADER, ConversionClient, ConversionService, LocalClient,
+)
+
+
+def build_archive(meta: str = "Test Song\n3\nbgm\nGroup A,Group B\n") -> bytes:
+    ''' Builds a small legacy .ootrs archive in memory '''
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zip_archive:
+        zip_archive.writestr('Test Song.seq', bytes(range(256)) * 4)
+        zip_archive.writestr('Test Song.meta', meta)
+    return output.getvalue()
+
+
+class ServiceTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.service = ConversionService(max_jobs=2)
+        self.server = await self.service.serve('127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.service.close()
+
+    async def check_client(self, client) -> None:
+        await client.connect()
+        try:
+            converted = await client.convert('song.ootrs', build_archive())
+            self.assertTrue(converted.converted)
+            self.assertIsNone(converted.error)
+            with zipfile.ZipFile(io.BytesIO(converted.data)) as zip_archive:
+                self.assertIn('Test Song.metadata', zip_archive.namelist())
+                self.assertNotIn('Test Song.meta', zip_archive.namelist())
+
+            # An archive that is already converted comes back as it was sent
+            skipped = await client.convert('converted.ootrs', converted.data)
+            self.assertFalse(skipped.converted)
+            self.assertIsNone(skipped.error)
+            self.assertEqual(skipped.data, converted.data)
+
+            failed = await client.convert('broken.ootrs', b'not a zip archive')
+            self.assertFalse(failed.converted)
+            self.assertIsNotNone(failed.error)
+
+            # Jobs on one connection may finish in any order, but each result keeps its own name
+            results = await asyncio.gather(*(client.convert(f'song_{i}.ootrs', build_archive()) for i in range(5)))
+            self.assertEqual([result.name for result in results], [f'song_{i}.ootrs' for i in range(5)])
+            self.assertTrue(all(result.converted for result in results))
+        finally:
+            await client.close()
+
+    async def test_local_client(self):
+        await self.check_client(LocalClient(self.service))
+
+    async def test_tcp_client(self):
+        await self.check_client(ConversionClient('127.0.0.1', self.port))
+
+    async def check_rejected(self, name_length: int, data_length: int) -> None:
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        try:
+            writer.write(REQUEST_HEADER.pack(1, name_length, data_length))
+            await writer.drain()
+            # The service hangs up instead of waiting for the rest of the frame
+            self.assertEqual(await asyncio.wait_for(reader.read(), timeout=5), b'')
+        finally:
+            writer.close()
+
+    async def test_oversized_archive_is_rejected(self):
+        await self.check_rejected(4, MAX_ARCHIVE_SIZE + 1)
+
+    async def test_oversized_name_is_rejected(self):
+        await self.check_rejected(MAX_NAME_LENGTH + 1, 16)
+
+    async def test_lost_connection_fails_pending_jobs(self):
+        client = ConversionClient('127.0.0.1', self.port)
+        await client.connect()
+        try:
+            with self.assertRaises(ConnectionError):
+                await client.convert('x' * (MAX_NAME_LENGTH + 1), build_archive())
+        finally:
+            await client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
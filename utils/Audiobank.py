@@ -1,90 +1,186 @@
-class Audiobank:
-    def __init__(self, bankmeta_bytes: bytearray, bank_bytes: bytearray):
-        if len(bankmeta_bytes) != 8:
-            raise Exception()
+import struct
+from typing import Final
 
-        self.sample_medium: int   = bankmeta_bytes[0]
-        self.seq_player: int      = bankmeta_bytes[1]
-        self.table_id: int        = bankmeta_bytes[2]
-        self.font_id: int         = bankmeta_bytes[3]
-        self.num_instruments: int = bankmeta_bytes[4]
-        self.num_drums: int       = bankmeta_bytes[5]
-        self.num_effects: int     = int.from_bytes(bankmeta_bytes[6:8], 'big')
 
-        self.instruments: list[Instrument] = []
-        self.drums: list[Drum]             = []
-        self.effects: list[SoundEffect]    = []
+# Precompiled big-endian layouts of the bank structures, read in place without slicing the bank
+BANKMETA_STRUCT: Final           = struct.Struct('>6BH')      # medium, seq player, table id, font id, instrument/drum/sfx counts
+BANK_HEADER_STRUCT: Final        = struct.Struct('>2I')       # drum list offset, sfx list offset
+POINTER_STRUCT: Final            = struct.Struct('>I')
+INSTRUMENT_SAMPLES_STRUCT: Final = struct.Struct('>8xI4xI4xI')  # low, prim and high sample offsets
+ADDRESS_STRUCT: Final            = struct.Struct('>4xI')      # sample address
 
-        for i in range(0, self.num_instruments):
-            offset = 0x8 + (0x4 * i)
-            instrument_offset = int.from_bytes(bank_bytes[offset:offset + 4], 'big')
-            instrument = Instrument(i, instrument_offset, bank_bytes) if instrument_offset != 0 else None
-            self.instruments.append(instrument)
 
-        drumlist_offset = int.from_bytes(bank_bytes[0:4], 'big')
-        for i in range(0, self.num_drums):
-            offset = drumlist_offset + (0x4 * i)
-            drum_offset = int.from_bytes(bank_bytes[offset:offset + 4], 'big')
-            drum = Drum(i, drum_offset, bank_bytes) if drum_offset != 0 else None
-            self.drums.append(drum)
+def read_u32(bank_view: memoryview, offset: int) -> int:
+    ''' Reads a big-endian pointer, treating bytes past the end of the bank as missing like a slice would '''
+    try:
+        return POINTER_STRUCT.unpack_from(bank_view, offset)[0]
+    except struct.error:
+        return int.from_bytes(bank_view[offset:offset + 4], 'big')
 
-        sfxlist_offset = int.from_bytes(bank_bytes[4:8], 'big')
-        for i in range(0, self.num_effects):
-            offset = sfxlist_offset + (8 * i)
-            effect = SoundEffect(i, offset, bank_bytes) if offset != 0 else None
-            self.effects.append(effect)
 
-    def get_bank_samples(self):
-        all_samples = []
+# Marks table entries that have not been decoded yet, since None marks an empty entry
+UNDECODED: Final = object()
 
-        for instrument in self.instruments:
+
+class Audiobank:
+    __slots__ = (
+        'sample_medium', 'seq_player', 'table_id', 'font_id',
+        'num_instruments', 'num_drums', 'num_effects',
+        'bank_view', 'drumlist_offset', 'sfxlist_offset',
+        '_instruments', '_drums', '_effects', '_samples_by_address', '_unindexed_samples',
+    )
+
+    def __init__(self, bankmeta_bytes: bytes | bytearray | memoryview, bank_bytes: bytes | bytearray | memoryview):
+        if len(bankmeta_bytes) != 8:
+            raise Exception()
+
+        (self.sample_medium, self.seq_player, self.table_id, self.font_id,
+         self.num_instruments, self.num_drums, self.num_effects) = BANKMETA_STRUCT.unpack_from(bankmeta_bytes)
+
+        # Table entries are only decoded the first time they are used
+        self.bank_view = memoryview(bank_bytes)
+        self.drumlist_offset = read_u32(self.bank_view, 0)
+        self.sfxlist_offset = read_u32(self.bank_view, 4)
+
+        self._instruments: list = [UNDECODED] * self.num_instruments
+        self._drums: list       = [UNDECODED] * self.num_drums
+        self._effects: list     = [UNDECODED] * self.num_effects
+
+        # Samples sharing an address keep the bank's sample order
+        self._samples_by_address: dict[int, list[Sample]] = {}
+        self._unindexed_samples = self.iter_bank_samples()
+
+    def get_instrument(self, index: int):
+        instrument = self._instruments[index]
+        if instrument is UNDECODED:
+            instrument_offset = read_u32(self.bank_view, 0x8 + (0x4 * index))
+            instrument = Instrument(index, instrument_offset, self.bank_view) if instrument_offset != 0 else None
+            self._instruments[index] = instrument
+        return instrument
+
+    def get_drum(self, index: int):
+        drum = self._drums[index]
+        if drum is UNDECODED:
+            drum_offset = read_u32(self.bank_view, self.drumlist_offset + (0x4 * index))
+            drum = Drum(index, drum_offset, self.bank_view) if drum_offset != 0 else None
+            self._drums[index] = drum
+        return drum
+
+    def get_effect(self, index: int):
+        effect = self._effects[index]
+        if effect is UNDECODED:
+            offset = self.sfxlist_offset + (8 * index)
+            effect = SoundEffect(index, offset, self.bank_view) if offset != 0 else None
+            self._effects[index] = effect
+        return effect
+
+    @property
+    def instruments(self):
+        return [self.get_instrument(i) for i in range(0, self.num_instruments)]
+
+    @property
+    def drums(self):
+        return [self.get_drum(i) for i in range(0, self.num_drums)]
+
+    @property
+    def effects(self):
+        return [self.get_effect(i) for i in range(0, self.num_effects)]
+
+    def iter_bank_samples(self):
+        ''' Yields every sample in bank order, decoding entries as it reaches them '''
+        for i in range(0, self.num_instruments):
+            instrument = self.get_instrument(i)
             if instrument is not None:
                 if instrument.low_sample is not None:
-                    all_samples.append(instrument.low_sample)
+                    yield instrument.low_sample
                 if instrument.prim_sample is not None:
-                    all_samples.append(instrument.prim_sample)
+                    yield instrument.prim_sample
                 if instrument.high_sample is not None:
-                    all_samples.append(instrument.high_sample)
+                    yield instrument.high_sample
 
-        for drum in self.drums:
+        for i in range(0, self.num_drums):
+            drum = self.get_drum(i)
             if drum is not None and drum.sample is not None:
-                all_samples.append(drum.sample)
+                yield drum.sample
 
-        for effect in self.effects:
+        for i in range(0, self.num_effects):
+            effect = self.get_effect(i)
             if effect is not None and effect.sample is not None:
-                all_samples.append(effect.sample)
+                yield effect.sample
+
+    def get_bank_samples(self):
+        return list(self.iter_bank_samples())
+
+    @property
+    def samples_by_address(self) -> dict:
+        for sample in self._unindexed_samples:
+            self._samples_by_address.setdefault(sample.address, []).append(sample)
+        return self._samples_by_address
+
+    def find_sample(self, address: int):
+        ''' Returns the first sample in bank order that uses the address, or None '''
+        # Everything before the first unindexed sample is already indexed, so a hit is always the earliest one
+        samples = self._samples_by_address.get(address)
+        if samples:
+            return samples[0]
+
+        for sample in self._unindexed_samples:
+            self._samples_by_address.setdefault(sample.address, []).append(sample)
+            if sample.address == address:
+                return sample
 
-        return all_samples
+        return None
+
+    def release(self) -> None:
+        ''' Lets go of the bank's buffer, which a memory-mapped archive needs before it can be closed '''
+        # The pending generator refers back to the bank, so it would keep the view alive until a collection
+        self._unindexed_samples.close()
+        self.bank_view.release()
 
 
 class Instrument:
-    def __init__(self, instrument_index: int, instrument_offset: int, bank_bytes: bytearray):
+    __slots__ = (
+        'index', 'low_sample_offset', 'prim_sample_offset', 'high_sample_offset',
+        'low_sample', 'prim_sample', 'high_sample',
+    )
+
+    def __init__(self, instrument_index: int, instrument_offset: int, bank_view: memoryview):
         self.index = instrument_index
-        self.low_sample_offset = int.from_bytes(bank_bytes[instrument_offset + 8: instrument_offset + 12], 'big')
-        self.prim_sample_offset = int.from_bytes(bank_bytes[instrument_offset + 16: instrument_offset + 20], 'big')
-        self.high_sample_offset = int.from_bytes(bank_bytes[instrument_offset + 24: instrument_offset + 28], 'big')
 
-        self.low_sample = Sample(self.low_sample_offset, bank_bytes, self.index, self, "LOW") if self.low_sample_offset != 0 else None
-        self.prim_sample = Sample(self.prim_sample_offset, bank_bytes, self.index, self, "PRIM") if self.prim_sample_offset != 0 else None
-        self.high_sample = Sample(self.high_sample_offset, bank_bytes, self.index, self, "HIGH") if self.high_sample_offset != 0 else None
+        try:
+            self.low_sample_offset, self.prim_sample_offset, self.high_sample_offset = INSTRUMENT_SAMPLES_STRUCT.unpack_from(bank_view, instrument_offset)
+        except struct.error:
+            self.low_sample_offset = read_u32(bank_view, instrument_offset + 8)
+            self.prim_sample_offset = read_u32(bank_view, instrument_offset + 16)
+            self.high_sample_offset = read_u32(bank_view, instrument_offset + 24)
+
+        self.low_sample = Sample(self.low_sample_offset, bank_view, self.index, self, "LOW") if self.low_sample_offset != 0 else None
+        self.prim_sample = Sample(self.prim_sample_offset, bank_view, self.index, self, "PRIM") if self.prim_sample_offset != 0 else None
+        self.high_sample = Sample(self.high_sample_offset, bank_view, self.index, self, "HIGH") if self.high_sample_offset != 0 else None
 
 
 class Drum:
-    def __init__(self, drum_index: int, drum_offset: int, bank_bytes: bytearray):
+    __slots__ = ('index', 'sample_offset', 'sample')
+
+    def __init__(self, drum_index: int, drum_offset: int, bank_view: memoryview):
         self.index = drum_index
-        self.sample_offset = int.from_bytes(bank_bytes[drum_offset + 4:drum_offset + 8], 'big')
-        self.sample = Sample(self.sample_offset, bank_bytes, self.index, self)
+        self.sample_offset = read_u32(bank_view, drum_offset + 4)
+        self.sample = Sample(self.sample_offset, bank_view, self.index, self)
 
 
 class SoundEffect:
-    def __init__(self, effect_index: int, effect_offset: int, bank_bytes: bytearray):
+    __slots__ = ('index', 'sample_offset', 'sample')
+
+    def __init__(self, effect_index: int, effect_offset: int, bank_view: memoryview):
         self.index = effect_index
-        self.sample_offset = int.from_bytes(bank_bytes[effect_offset:effect_offset + 4], 'big')
-        self.sample = Sample(self.sample_offset, bank_bytes, self.index, self)
+        self.sample_offset = read_u32(bank_view, effect_offset)
+        self.sample = Sample(self.sample_offset, bank_view, self.index, self)
 
 
 class Sample:
-    def __init__(self, sample_offset: int, bank_bytes: bytearray, parent_index: int, parent: Instrument | Drum, key_region: str = None):
+    __slots__ = ('parent', 'parent_type', 'parent_index', 'key_region', 'address')
+
+    def __init__(self, sample_offset: int, bank_view: memoryview, parent_index: int, parent: Instrument | Drum, key_region: str = None):
         self.parent = parent
         if isinstance(self.parent, Instrument):
             self.parent_type = "INST"
@@ -96,4 +192,7 @@ class Sample:
         self.parent_index = parent_index
         self.key_region = key_region
 
-        self.address = int.from_bytes(bank_bytes[sample_offset + 4:sample_offset + 8], 'big')
+        try:
+            self.address = ADDRESS_STRUCT.unpack_from(bank_view, sample_offset)[0]
+        except struct.error:
+            self.address = read_u32(bank_view, sample_offset + 4)
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Final, Iterable
+
+from utils.Audiobank import Audiobank
+
+
+# Bump whenever the way sample addresses are resolved changes, so cached indexes on disk are rebuilt
+CACHE_VERSION: Final[int] = 1
+
+# A sample's parent type, parent index and key region (None for drums and sound effects)
+SampleLink = tuple[str, int, str | None]
+
+
+def bank_digest(bankmeta_bytes: bytes, bank_bytes: bytes) -> str:
+    ''' Hashes a .bankmeta/.zbank pair, so identical banks from different archives share one entry '''
+    digest = hashlib.sha256(bankmeta_bytes)
+    digest.update(bank_bytes)
+    return digest.hexdigest()
+
+
+def build_address_index(audiobank: Audiobank) -> dict[int, SampleLink]:
+    ''' Maps every sample address in the bank to the first sample in bank order that uses it '''
+    return {
+        address: (samples[0].parent_type, samples[0].parent_index, samples[0].key_region)
+        for address, samples in audiobank.samples_by_address.items()
+    }
+
+
+def find_address_links(audiobank: Audiobank, addresses: Iterable[int]) -> dict[int, SampleLink]:
+    ''' Maps only the given addresses, decoding the bank no further than the last sample it has to find '''
+    index: dict[int, SampleLink] = {}
+    for address in addresses:
+        sample = audiobank.find_sample(address)
+        if sample is not None:
+            index[address] = (sample.parent_type, sample.parent_index, sample.key_region)
+    return index
+
+
+class BankCache:
+    ''' Content-addressed LRU cache of sample address indexes, optionally persisted to a folder '''
+
+    def __init__(self, max_entries: int = 256, folder: str = None):
+        self.max_entries = max_entries
+        self.folder = folder
+        self.entries: OrderedDict[str, dict[int, SampleLink]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_address_index(self, bankmeta_bytes: bytes, bank_bytes: bytes) -> dict[int, SampleLink]:
+        ''' Returns the bank's address index, parsing the bank only if no archive has shipped it before '''
+        digest = bank_digest(bankmeta_bytes, bank_bytes)
+
+        with self.lock:
+            index = self.entries.get(digest)
+            if index is not None:
+                self.entries.move_to_end(digest)
+                self.hits += 1
+                return index
+
+        index = self.load(digest)
+        if index is None:
+            # A miss decodes the whole bank, since later archives may ask for any of its addresses
+            audiobank = Audiobank(bankmeta_bytes, bank_bytes)
+            try:
+                index = build_address_index(audiobank)
+            finally:
+                audiobank.release()
+            self.save(digest, index)
+
+        with self.lock:
+            self.misses += 1
+            self.entries[digest] = index
+            self.entries.move_to_end(digest)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        return index
+
+    def entry_path(self, digest: str) -> str:
+        return os.path.join(self.folder, digest[:2], f"{digest}.json")
+
+    def load(self, digest: str) -> dict[int, SampleLink] | None:
+        ''' Reads a persisted index, treating a missing, outdated or damaged file as a miss '''
+        if self.folder is None:
+            return None
+
+        try:
+            with open(self.entry_path(digest), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data["version"] != CACHE_VERSION:
+                return None
+            return {address: (parent_type, parent_index, key_region) for address, parent_type, parent_index, key_region in data["samples"]}
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, digest: str, index: dict[int, SampleLink]) -> None:
+        ''' Persists an index; workers may race on the same bank, so each writes its own file and renames it '''
+        if self.folder is None:
+            return
+
+        path = self.entry_path(digest)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": CACHE_VERSION, "samples": [[address, *link] for address, link in index.items()]}, f)
+            os.replace(temp_path, path)
+        except OSError:
+            # The cache only saves work, so failing to persist it must not fail the conversion
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
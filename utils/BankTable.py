@@ -0,0 +1,266 @@
+import csv
+import io
+import os
+import zipfile
+from array import array
+from typing import Final, Iterable, Iterator
+
+from utils.Audiobank import BANKMETA_STRUCT, read_u32
+from utils.Converter import SCAN_CONVERTED, parse_meta, scan_archive
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Codes stored in the parent type and key region columns; drums and sound effects have no key region
+PARENT_TYPES: Final[tuple[str, ...]] = ("INST", "DRUM", "SFX")
+KEY_REGION_CODES: Final[tuple[str | None, ...]] = (None, "LOW", "PRIM", "HIGH")
+
+INST: Final[int] = 0
+DRUM: Final[int] = 1
+SFX: Final[int]  = 2
+
+# Stored in the instrument set column for archives that ship their own bank
+CUSTOM_INSTRUMENT_SET: Final[int] = -1
+
+# Typecodes of the per-archive and per-sample columns
+ARCHIVE_COLUMNS: Final[dict[str, str]] = {
+    'instrument_set': 'i', 'has_bank': 'B', 'num_instruments': 'H', 'num_drums': 'H', 'num_effects': 'H', 'drum_samples': 'H', 'effect_samples': 'H',
+}
+SAMPLE_COLUMNS: Final[dict[str, str]] = {
+    'archive_id': 'I', 'parent_type': 'B', 'parent_index': 'H', 'key_region': 'B', 'address': 'I',
+}
+
+
+class BankTable:
+    '''
+    The samples of many banks as parallel columns, so a whole library can be queried at once.
+
+    Archives are numbered in the order they are added. Each archive has one row in the archive columns, and
+    each sample of its bank has one row in the sample columns, in the same order Audiobank.iter_bank_samples
+    yields them. The columns are array.array; columns() hands them out as NumPy arrays when NumPy is installed.
+    '''
+
+    def __init__(self):
+        self.archives: list[str] = []
+        self.archive_columns: dict[str, array] = {name: array(typecode) for name, typecode in ARCHIVE_COLUMNS.items()}
+        self.sample_columns: dict[str, array] = {name: array(typecode) for name, typecode in SAMPLE_COLUMNS.items()}
+
+    def __len__(self) -> int:
+        return len(self.sample_columns['address'])
+
+    def add_archive(self, name: str, instrument_set: int, bankmeta_bytes: bytes = None, bank_bytes: bytes = None) -> int:
+        ''' Adds an archive, reading its bank's tables into the columns, and returns its id '''
+        archive_id = len(self.archives)
+        samples = {column_name: array(typecode) for column_name, typecode in SAMPLE_COLUMNS.items()}
+
+        num_instruments = num_drums = num_effects = drum_samples = effect_samples = 0
+        has_bank = bankmeta_bytes is not None and bank_bytes is not None
+
+        if has_bank:
+            if len(bankmeta_bytes) != 8:
+                raise ValueError(f'BankTable Error: Expected an 8 byte bankmeta for "{name}", but got {len(bankmeta_bytes)} bytes instead.')
+
+            num_instruments, num_drums, num_effects = BANKMETA_STRUCT.unpack_from(bankmeta_bytes)[4:7]
+            drum_samples, effect_samples = read_samples(samples, archive_id, memoryview(bank_bytes), num_instruments, num_drums, num_effects)
+
+        # Nothing is added until nothing can fail, so a rejected archive never shifts the rows of the archives after it
+        self.archives.append(name)
+        for column_name, column in self.sample_columns.items():
+            column.extend(samples[column_name])
+
+        columns = self.archive_columns
+        columns['instrument_set'].append(instrument_set)
+        columns['has_bank'].append(has_bank)
+        columns['num_instruments'].append(num_instruments)
+        columns['num_drums'].append(num_drums)
+        columns['num_effects'].append(num_effects)
+        columns['drum_samples'].append(drum_samples)
+        columns['effect_samples'].append(effect_samples)
+
+        return archive_id
+
+    def extend(self, other: 'BankTable') -> None:
+        ''' Appends another table, renumbering its archives to follow this table's '''
+        offset = len(self.archives)
+        self.archives.extend(other.archives)
+
+        for name, column in self.archive_columns.items():
+            column.extend(other.archive_columns[name])
+
+        for name, column in self.sample_columns.items():
+            if name == 'archive_id':
+                column.extend(archive_id + offset for archive_id in other.sample_columns[name])
+            else:
+                column.extend(other.sample_columns[name])
+
+    def columns(self) -> dict[str, array]:
+        ''' Every column by name, as NumPy arrays sharing the columns' memory when NumPy is installed, which stops the table growing while they live '''
+        columns = {**self.archive_columns, **self.sample_columns}
+        if numpy is None:
+            return columns
+        return {name: numpy.frombuffer(column, dtype=column.typecode) for name, column in columns.items()}
+
+    def shared_addresses(self, min_archives: int = 2) -> dict[int, list[int]]:
+        ''' Maps each sample address used by at least min_archives archives to the ids of those archives '''
+        if numpy is not None:
+            columns = self.columns()
+            pairs = numpy.unique(numpy.stack([columns['address'].astype(numpy.int64), columns['archive_id'].astype(numpy.int64)]), axis=1)
+            addresses, starts, counts = numpy.unique(pairs[0], return_index=True, return_counts=True)
+            return {
+                int(address): pairs[1, start:start + count].tolist()
+                for address, start, count in zip(addresses, starts, counts) if count >= min_archives
+            }
+
+        archives_by_address: dict[int, set[int]] = {}
+        for address, archive_id in zip(self.sample_columns['address'], self.sample_columns['archive_id']):
+            archives_by_address.setdefault(address, set()).add(archive_id)
+
+        return {address: sorted(archive_ids) for address, archive_ids in sorted(archives_by_address.items()) if len(archive_ids) >= min_archives}
+
+    def custom_archives(self) -> list[int]:
+        ''' Ids of the archives whose .meta asks for a custom instrument set '''
+        return [archive_id for archive_id, instrument_set in enumerate(self.archive_columns['instrument_set']) if instrument_set == CUSTOM_INSTRUMENT_SET]
+
+    def empty_tables(self) -> list[tuple[int, str]]:
+        ''' (archive id, "DRUM" or "SFX") for every custom bank whose drum or sound effect table has no samples '''
+        columns = self.archive_columns
+        empty: list[tuple[int, str]] = []
+
+        for archive_id in self.custom_archives():
+            # An archive that ships no bank has no tables to be empty
+            if not columns['has_bank'][archive_id]:
+                continue
+            if columns['drum_samples'][archive_id] == 0:
+                empty.append((archive_id, "DRUM"))
+            if columns['effect_samples'][archive_id] == 0:
+                empty.append((archive_id, "SFX"))
+
+        return empty
+
+    def iter_samples(self) -> Iterator[tuple[str, str, int, str | None, int]]:
+        ''' Yields every sample as (archive, parent type, index, key region, address) '''
+        for archive_id, parent_type, parent_index, key_region, address in zip(*self.sample_columns.values()):
+            yield self.archives[archive_id], PARENT_TYPES[parent_type], parent_index, KEY_REGION_CODES[key_region], address
+
+    def write_csv(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['archive', 'parent_type', 'parent_index', 'key_region', 'address'])
+            for archive, parent_type, parent_index, key_region, address in self.iter_samples():
+                writer.writerow([archive, parent_type, parent_index, key_region or '', f"0x{address:08X}"])
+
+    def summarize(self, min_archives: int = 2) -> dict:
+        shared = self.shared_addresses(min_archives)
+
+        return {
+            "archives": len(self.archives),
+            "samples": len(self),
+            "custom_instrument_sets": [self.archives[archive_id] for archive_id in self.custom_archives()],
+            "shared_addresses": {f"0x{address:08X}": [self.archives[archive_id] for archive_id in archive_ids] for address, archive_ids in shared.items()},
+            "empty_tables": [{"archive": self.archives[archive_id], "table": table} for archive_id, table in self.empty_tables()],
+        }
+
+
+def read_samples(columns: dict[str, array], archive_id: int, bank_view: memoryview, num_instruments: int, num_drums: int,
+                 num_effects: int) -> tuple[int, int]:
+    ''' Appends a bank's samples to sample columns, walking its tables the way Audiobank does without an object per entry '''
+    archive_ids, parent_types, parent_indexes, key_regions, addresses = columns.values()
+    drumlist_offset = read_u32(bank_view, 0)
+    sfxlist_offset = read_u32(bank_view, 4)
+
+    def add(parent_type: int, parent_index: int, key_region: int, sample_offset: int) -> None:
+        archive_ids.append(archive_id)
+        parent_types.append(parent_type)
+        parent_indexes.append(parent_index)
+        key_regions.append(key_region)
+        addresses.append(read_u32(bank_view, sample_offset + 4))
+
+    for i in range(num_instruments):
+        instrument_offset = read_u32(bank_view, 0x8 + (0x4 * i))
+        if instrument_offset == 0:
+            continue
+
+        for key_region in (1, 2, 3):
+            sample_offset = read_u32(bank_view, instrument_offset + (8 * key_region))
+            if sample_offset != 0:
+                add(INST, i, key_region, sample_offset)
+
+    drum_samples = 0
+    for i in range(num_drums):
+        drum_offset = read_u32(bank_view, drumlist_offset + (0x4 * i))
+        if drum_offset != 0:
+            sample_offset = read_u32(bank_view, drum_offset + 4)
+            # Like Audiobank, an entry without a sample is still listed, so only the counts leave it out
+            add(DRUM, i, 0, sample_offset)
+            drum_samples += sample_offset != 0
+
+    effect_samples = 0
+    for i in range(num_effects):
+        effect_offset = sfxlist_offset + (8 * i)
+        if effect_offset != 0:
+            sample_offset = read_u32(bank_view, effect_offset)
+            add(SFX, i, 0, sample_offset)
+            effect_samples += sample_offset != 0
+
+    return drum_samples, effect_samples
+
+
+def read_converted_archive(zip_archive: zipfile.ZipFile) -> tuple[str | int, str | None, str | None]:
+    ''' Reads the instrument set from a converted archive's .metadata, returning it with the names of its .bankmeta and .zbank '''
+    import yaml
+
+    metadata = bankmeta = bank = None
+    for name in zip_archive.namelist():
+        extension = os.path.splitext(name)[1].lower()
+        if extension == '.metadata':
+            metadata = name
+        elif extension == '.bankmeta':
+            bankmeta = name
+        elif extension == '.zbank':
+            bank = name
+
+    with zip_archive.open(metadata) as metadata_member:
+        yaml_dict = yaml.safe_load(metadata_member)
+
+    try:
+        instrument_set = yaml_dict["metadata"]["instrument set"]
+    except (KeyError, TypeError):
+        raise ValueError(f'read_archive_banks Error: "{metadata}" has no instrument set.')
+
+    if instrument_set != "custom" and (not isinstance(instrument_set, int) or isinstance(instrument_set, bool)):
+        raise ValueError(f'read_archive_banks Error: Expected "custom" or a hexadecimal instrument set in "{metadata}", but got "{instrument_set}" instead.')
+
+    return instrument_set, bankmeta, bank
+
+
+def read_archive_banks(paths: Iterable[str]) -> tuple[BankTable, list[tuple[str, str]]]:
+    ''' Reads the banks of several archives into one table, returning it with the (path, error) of each archive that failed '''
+    table = BankTable()
+    errors: list[tuple[str, str]] = []
+
+    for path in paths:
+        try:
+            with zipfile.ZipFile(path, 'r') as zip_archive:
+                scan = scan_archive(zip_archive)
+
+                # Converted archives keep the same bank files, and store the instrument set in their .metadata
+                if scan.status == SCAN_CONVERTED:
+                    instrument_set, bankmeta, bank = read_converted_archive(zip_archive)
+                elif scan.convertible:
+                    with zip_archive.open(scan.meta) as meta_member, io.TextIOWrapper(meta_member) as meta_file:
+                        instrument_set = parse_meta(meta_file).instrument_set
+                    bankmeta, bank = scan.bankmeta, scan.bank
+                else:
+                    raise ValueError(f'read_archive_banks Error: Archive is {scan.status}: {scan.reason}')
+
+                bankmeta_bytes = zip_archive.read(bankmeta) if bankmeta else None
+                bank_bytes = zip_archive.read(bank) if bank else None
+
+            table.add_archive(path, CUSTOM_INSTRUMENT_SET if instrument_set == "custom" else instrument_set, bankmeta_bytes, bank_bytes)
+        except Exception as e:
+            errors.append((path, str(e)))
+
+    return table, errors
@@ -0,0 +1,915 @@
+import io
+import mmap
+import os
+import re
+import shutil
+import struct
+import threading
+import time
+import zipfile
+import zlib
+from contextlib import contextmanager
+from typing import Callable, ContextManager, Final, Iterable, Iterator, TextIO
+
+from utils.Audiobank import Audiobank
+from utils.BankCache import BankCache, SampleLink, find_address_links
+
+
+# If the music groups line is empty, assign defaults based on the song type
+DEFAULT_BGM_CATEGORIES: Final[list[str]] = [
+    "Fields", "Town", "Dungeon", "Indoors", "Fun", "Fight", "CharacterTheme",
+]
+
+DEFAULT_FANFARE_CATEGORIES: Final[list[str]] = [
+    "EventFanfare", "SongFanfare"
+]
+
+# Bump whenever a change alters the converted output, so that previously converted files are rebuilt
+CONVERTER_VERSION: Final[str] = '2'
+
+# Buffer size used when streaming members from the original archive into the new one
+COPY_CHUNK_SIZE: Final[int] = 1024 * 1024
+
+# Fields of a zip local file header, used to find where a member's compressed bytes start
+LOCAL_HEADER_SIGNATURE: Final[int]     = 0
+LOCAL_HEADER_NAME_LENGTH: Final[int]   = 10
+LOCAL_HEADER_EXTRA_LENGTH: Final[int]  = 11
+DATA_DESCRIPTOR_FLAG: Final[int]       = 0x08
+ENCRYPTED_FLAG: Final[int]             = 0x01
+
+# Compression methods zipfile can read
+READABLE_COMPRESSION: Final[set[int]] = {zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2, zipfile.ZIP_LZMA}
+
+# Ways a member can be compressed: 'keep' copies its compressed bytes untouched, and 'auto' stores it if a
+# trial compression of its start barely shrinks it, deflating it otherwise
+COMPRESSION_METHODS: Final[dict[str, int]] = {
+    'store': zipfile.ZIP_STORED, 'deflate': zipfile.ZIP_DEFLATED, 'bzip2': zipfile.ZIP_BZIP2, 'lzma': zipfile.ZIP_LZMA,
+}
+COMPRESSION_CHOICES: Final[list[str]] = ['keep', 'auto', *COMPRESSION_METHODS]
+
+# How much of a member 'auto' compresses as a trial, at the fastest level since only the ratio matters,
+# and the compressed share above which it stores the member instead
+AUTO_TRIAL_SIZE: Final[int] = 16 * 1024
+AUTO_TRIAL_LEVEL: Final[int] = 1
+AUTO_STORE_RATIO: Final[float] = 0.9
+
+# Key regions an instrument sample can belong to
+KEY_REGIONS: Final[tuple[str, ...]] = ("LOW", "PRIM", "HIGH")
+
+# Numbers as int() and int(text, 16) read them, including surrounding whitespace, signs and underscores
+DECIMAL_PATTERN: Final = re.compile(r'\s*[+-]?\d+(?:_\d+)*\s*')
+HEXADECIMAL_PATTERN: Final = re.compile(r'\s*[+-]?(?:0[xX](?:_?[\da-fA-F])+|[\da-fA-F]+(?:_[\da-fA-F]+)*)\s*')
+
+# Outcomes of scanning an archive's central directory
+SCAN_CONVERTIBLE: Final[str] = 'convertible'
+SCAN_CONVERTED: Final[str]   = 'converted'
+SCAN_INCOMPLETE: Final[str]  = 'incomplete'
+SCAN_MALFORMED: Final[str]   = 'malformed'
+
+
+class StageTimer:
+    ''' Records the wall time and bytes of each conversion stage for a single file '''
+
+    def __init__(self):
+        self.seconds: dict[str, float] = {}
+        self.bytes: dict[str, int] = {}
+        self.active: list[str] = []
+        self.started: float = 0.0
+        self.failed_stage: str = None
+
+    @contextmanager
+    def stage(self, name: str):
+        ''' Times a stage; a nested stage pauses the one around it so no time is counted twice '''
+        now = time.perf_counter()
+        if self.active:
+            self.add_time(self.active[-1], now - self.started)
+        self.active.append(name)
+        self.started = now
+
+        try:
+            yield
+        except BaseException:
+            # The innermost stage sees the exception first, so it is the one blamed for it
+            if self.failed_stage is None:
+                self.failed_stage = name
+            raise
+        finally:
+            now = time.perf_counter()
+            self.add_time(self.active.pop(), now - self.started)
+            self.started = now
+
+    def add_time(self, name: str, seconds: float) -> None:
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def add_bytes(self, name: str, count: int) -> None:
+        self.bytes[name] = self.bytes.get(name, 0) + count
+
+    def as_dict(self) -> dict[str, tuple[float, int]]:
+        return {name: (seconds, self.bytes.get(name, 0)) for name, seconds in self.seconds.items()}
+
+
+class SkipFileException(Exception):
+    ''' Exception to be raised if a file does not require conversion '''
+    pass
+
+
+class ArchiveScan:
+    ''' What an archive's central directory says it holds, and why it cannot be converted if it cannot '''
+
+    def __init__(self):
+        self.status: str = SCAN_CONVERTIBLE
+        self.reason: str = None
+        self.sequence: str = None
+        self.meta: str = None
+        self.bank: str = None
+        self.bankmeta: str = None
+        self.zsounds: list[str] = []
+        self.members: int = 0
+        self.file_size: int = 0
+        self.compress_size: int = 0
+
+    @property
+    def convertible(self) -> bool:
+        return self.status == SCAN_CONVERTIBLE
+
+    def reject(self, status: str, reason: str) -> 'ArchiveScan':
+        self.status = status
+        self.reason = reason
+        return self
+
+    def as_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "reason": self.reason,
+            "sequence": self.sequence,
+            "meta": self.meta,
+            "bank": self.bank,
+            "bankmeta": self.bankmeta,
+            "zsounds": len(self.zsounds),
+            "members": self.members,
+            "file_size": self.file_size,
+            "compress_size": self.compress_size,
+        }
+
+
+def scan_archive(zip_archive: zipfile.ZipFile) -> ArchiveScan:
+    ''' Classifies an archive from its central directory alone, without reading or decompressing any member '''
+    scan = ArchiveScan()
+    members = [info for info in zip_archive.infolist() if not info.is_dir()]
+
+    for info in members:
+        if info.filename.endswith(".metadata"):
+            return scan.reject(SCAN_CONVERTED, "Archive contains .metadata, skipping.")
+
+    for info in members:
+        f = info.filename
+        scan.members += 1
+        scan.file_size += info.file_size
+        scan.compress_size += info.compress_size
+
+        if info.flag_bits & ENCRYPTED_FLAG:
+            return scan.reject(SCAN_MALFORMED, f'"{f}" is encrypted!')
+        if info.compress_type not in READABLE_COMPRESSION:
+            return scan.reject(SCAN_MALFORMED, f'"{f}" uses unsupported compression method {info.compress_type}!')
+        # Member data always lies before the central directory, so anything reaching past it is damaged
+        if info.header_offset + info.compress_size > zip_archive.start_dir:
+            return scan.reject(SCAN_MALFORMED, f'"{f}" extends past the end of the archive data!')
+
+        extension = os.path.splitext(f)[1].lower()
+
+        match extension:
+            case '.seq':
+                scan.sequence = f
+                continue
+            case '.meta':
+                scan.meta = f
+                continue
+            case '.bankmeta':
+                scan.bankmeta = f
+                continue
+            case '.zbank':
+                scan.bank = f
+                continue
+            case '.zsound':
+                scan.zsounds.append(f)
+                continue
+            case _:
+                continue
+
+    if not scan.sequence:
+        return scan.reject(SCAN_INCOMPLETE, 'No sequence file found!')
+    if not scan.meta:
+        return scan.reject(SCAN_INCOMPLETE, 'No meta file found!')
+
+    if scan.bank and not scan.bankmeta:
+        return scan.reject(SCAN_INCOMPLETE, 'No bankmeta file found!')
+    if not scan.bank and scan.bankmeta:
+        return scan.reject(SCAN_INCOMPLETE, 'No bank file found!')
+
+    return scan
+
+
+def scan_file(input_file: str) -> ArchiveScan:
+    ''' Scans an .ootrs file on disk, reporting a file that is not a readable zip as malformed '''
+    try:
+        with zipfile.ZipFile(input_file, 'r') as zip_archive:
+            return scan_archive(zip_archive)
+    except (zipfile.BadZipFile, OSError) as e:
+        return ArchiveScan().reject(SCAN_MALFORMED, str(e))
+
+
+class MusicArchive:
+    ''' Represents an .ootrs file storing its contents '''
+
+    def __init__(self, zip_archive: zipfile.ZipFile):
+        self.sequence: str = None
+        self.meta: str = None
+        self.bank: str = None
+        self.bankmeta: str = None
+        self.zsounds: list[str] = []
+        self.zip_archive = zip_archive
+
+    def read_members(self) -> None:
+        ''' Sorts the members of an .ootrs file by type without extracting them '''
+        scan = scan_archive(self.zip_archive)
+
+        if scan.status == SCAN_CONVERTED:
+            raise SkipFileException(scan.reason)
+        if scan.status == SCAN_MALFORMED:
+            raise zipfile.BadZipFile(f'MusicArchive Error: {scan.reason}')
+        if scan.status == SCAN_INCOMPLETE:
+            raise FileNotFoundError(f'MusicArchive Error: {scan.reason}')
+
+        self.sequence = scan.sequence
+        self.meta = scan.meta
+        self.bank = scan.bank
+        self.bankmeta = scan.bankmeta
+        self.zsounds = scan.zsounds
+
+
+class FlowStyleList(list):
+    pass
+
+
+class HexInt(int):
+    pass
+
+
+def represent_flow_style_list(dumper, data):
+    return dumper.represent_sequence('tag:yaml.org,2002:seq', data, flow_style=True)
+
+
+def represent_hexint(dumper, data):
+    return dumper.represent_scalar('tag:yaml.org,2002:int', f"0x{data:X}")
+
+
+# PyYAML is only imported once the first .metadata is written, so runs that scan or skip every file never load it
+yaml = None
+yaml_lock = threading.Lock()
+
+# libyaml's emitter, only available when PyYAML was built with it
+CDumper = None
+
+metadata_resolver = None
+libyaml_scalar_pattern: re.Pattern = None
+
+
+def load_yaml() -> None:
+    ''' Imports PyYAML and registers the .metadata representers with it, once per process '''
+    global yaml, CDumper, metadata_resolver, libyaml_scalar_pattern
+
+    with yaml_lock:
+        if yaml is not None:
+            return
+
+        import yaml as pyyaml
+
+        pyyaml.add_representer(FlowStyleList, represent_flow_style_list)
+        pyyaml.add_representer(HexInt, represent_hexint)
+
+        CDumper = getattr(pyyaml, 'CDumper', None)
+        if CDumper is not None:
+            pyyaml.add_representer(FlowStyleList, represent_flow_style_list, Dumper=CDumper)
+            pyyaml.add_representer(HexInt, represent_hexint, Dumper=CDumper)
+
+        metadata_resolver = pyyaml.resolver.Resolver()
+        libyaml_scalar_pattern = re.compile(LIBYAML_SCALAR_CHARACTERS)
+        # Set last, so that a thread that sees the module never sees it half set up
+        yaml = pyyaml
+
+
+# PyYAML folds lines past this width, and writes keys as complex keys once they reach 128 characters
+# counting the "!!str" tag it measures along with them
+METADATA_LINE_WIDTH: Final[int] = 80
+METADATA_KEY_LENGTH: Final[int] = 128 - len('!!str')
+
+# Strings PyYAML always writes unquoted: a letter or digit followed by word characters and harmless punctuation
+PLAIN_SCALAR_PATTERN: Final = re.compile(r"[^\W_][\w .()'&!+/~-]*")
+
+# Strings libyaml writes exactly like PyYAML: printable characters from the Basic Multilingual Plane, except the
+# line and paragraph separators, which libyaml folds as line breaks. Compiling the ranges takes a few milliseconds,
+# so it waits for load_yaml like the rest of the fallback
+LIBYAML_SCALAR_CHARACTERS: Final[str] = '[\x20-\x7E\xA0-\u2027\u202A-\uD7FF\uE000-\uFEFE\uFF00-\uFFFD]+'
+
+
+def format_plain_scalar(value) -> str | None:
+    ''' Formats a scalar the way PyYAML would write it unquoted, or returns None if it needs quoting '''
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, HexInt):
+        return f"0x{value:X}" if value >= 0 else None
+    if isinstance(value, int):
+        return str(value)
+
+    if not isinstance(value, str) or value.endswith(' ') or not PLAIN_SCALAR_PATTERN.fullmatch(value):
+        return None
+
+    # Strings such as "yes", "null" or "1e3" would load as other types, so PyYAML quotes them
+    if metadata_resolver.resolve(yaml.ScalarNode, value, (True, False)) != 'tag:yaml.org,2002:str':
+        return None
+
+    return value
+
+
+def emit_block_mapping(mapping: dict, indent: int, lines: list[str]) -> bool:
+    ''' Emits a block mapping of plain scalars, returning False if any of it needs the full emitter '''
+    for key, value in mapping.items():
+        key_text = format_plain_scalar(key) if isinstance(key, str) else None
+        if key_text is None or len(key_text) >= METADATA_KEY_LENGTH:
+            return False
+
+        prefix = f"{' ' * indent}{key_text}:"
+
+        if isinstance(value, dict):
+            if not value:
+                return False
+            lines.append(prefix)
+            if not emit_block_mapping(value, indent + 2, lines):
+                return False
+            continue
+
+        if isinstance(value, FlowStyleList):
+            items = [format_plain_scalar(item) for item in value]
+            if None in items:
+                return False
+            line = f"{prefix} [{', '.join(items)}]"
+        else:
+            value_text = format_plain_scalar(value)
+            if value_text is None:
+                return False
+            line = f"{prefix} {value_text}"
+
+        # Anything wider would be folded by PyYAML
+        if len(line) > METADATA_LINE_WIDTH:
+            return False
+
+        lines.append(line)
+
+    return True
+
+
+def emit_metadata(yaml_dict: dict) -> str | None:
+    ''' Writes the .metadata YAML directly, matching yaml.dump byte for byte, or returns None if it needs yaml.dump '''
+    # The resolver that decides which strings need quoting comes from PyYAML
+    if yaml is None:
+        load_yaml()
+
+    lines: list[str] = []
+
+    if not emit_block_mapping(yaml_dict, 0, lines):
+        return None
+
+    return '\n'.join(lines) + '\n'
+
+
+def is_libyaml_safe(data) -> bool:
+    ''' Checks whether libyaml writes the metadata exactly like PyYAML does, which it does not for every string '''
+    if isinstance(data, dict):
+        return all(
+            isinstance(key, str) and is_libyaml_safe(key) and len(key.encode('utf-8')) < METADATA_KEY_LENGTH and is_libyaml_safe(value)
+            for key, value in data.items()
+        )
+    if isinstance(data, list):
+        return all(is_libyaml_safe(item) for item in data)
+    if isinstance(data, str):
+        return libyaml_scalar_pattern.fullmatch(data) is not None
+    if isinstance(data, HexInt):
+        return data >= 0
+
+    return isinstance(data, int)
+
+
+def dump_metadata(yaml_dict: dict) -> str:
+    ''' Dumps the .metadata YAML through the fastest writer that produces the same output as yaml.dump '''
+    text = emit_metadata(yaml_dict)
+    if text is not None:
+        return text
+
+    dumper = CDumper if CDumper is not None and is_libyaml_safe(yaml_dict) else yaml.Dumper
+    return yaml.dump(yaml_dict, Dumper=dumper, sort_keys=False, allow_unicode=True)
+
+
+class CompressionPolicy:
+    ''' Chooses how each member of the new archive is compressed, by extension with a default for the rest '''
+
+    def __init__(self, method: str = 'keep', level: int = None):
+        self.default: tuple[str, int | None] = self.validate(method, level)
+        self.by_extension: dict[str, tuple[str, int | None]] = {}
+
+    @staticmethod
+    def validate(method: str, level: int = None) -> tuple[str, int | None]:
+        if method not in COMPRESSION_CHOICES:
+            raise ValueError(f'CompressionPolicy Error: Unknown compression method "{method}", expected one of {", ".join(COMPRESSION_CHOICES)}.')
+        if level is not None:
+            if method in ('keep', 'store', 'lzma'):
+                raise ValueError(f'CompressionPolicy Error: The "{method}" method does not take a level.')
+            if not (0 if method != 'bzip2' else 1) <= level <= 9:
+                raise ValueError(f'CompressionPolicy Error: Level {level} is out of range for "{method}".')
+        return method, level
+
+    def __str__(self) -> str:
+        ''' Describes the policy in the form parse reads, so that a change of policy can be detected '''
+        def describe(method: str, level: int | None) -> str:
+            return method if level is None else f"{method}:{level}"
+
+        return ','.join([describe(*self.default), *(f"{extension}={describe(*choice)}" for extension, choice in sorted(self.by_extension.items()))])
+
+    def set(self, extension: str, method: str, level: int = None) -> None:
+        self.by_extension[extension.lower()] = self.validate(method, level)
+
+    def for_member(self, filename: str) -> tuple[str, int | None]:
+        return self.by_extension.get(os.path.splitext(filename)[1].lower(), self.default)
+
+    @classmethod
+    def parse(cls, specs: Iterable[str], method: str = 'keep') -> 'CompressionPolicy':
+        ''' Builds a policy from "[.extension=]method[:level]" strings, where one without an extension sets the default '''
+        policy = cls(method)
+
+        for spec in specs:
+            extension, _, choice = spec.rpartition('=')
+            method, _, level = choice.partition(':')
+
+            if level and not level.isdecimal():
+                raise ValueError(f'CompressionPolicy Error: Expected a number for the level in "{spec}", but got "{level}" instead.')
+            level = int(level) if level else None
+
+            if extension:
+                policy.set(extension if extension.startswith('.') else f".{extension}", method, level)
+            else:
+                policy.default = cls.validate(method, level)
+
+        return policy
+
+
+def is_poorly_compressible(data: bytes) -> bool:
+    ''' Trial-compresses a sample of a member to see whether deflating it is worth the time '''
+    if not data:
+        return True
+    return len(zlib.compress(data, AUTO_TRIAL_LEVEL)) > len(data) * AUTO_STORE_RATIO
+
+
+def write_metadata(new_archive: zipfile.ZipFile, base_name: str, cosmetic_name: str, instrument_set: str | int, song_type: str, music_groups,
+                   zsounds: dict[str, dict[str, int]] = None, compression: CompressionPolicy = None):
+    ''' Writes the YAML .metadata file into the new archive '''
+    metadata_member = f"{base_name}.metadata"
+
+    yaml_dict: dict = {
+        "game": "oot",
+        "metadata": {
+            "display name": cosmetic_name,
+            "instrument set": HexInt(instrument_set) if isinstance(instrument_set, int) else instrument_set,
+            "song type": song_type,
+            "music groups": FlowStyleList([cat for cat in music_groups]),
+        }
+    }
+
+    if zsounds:
+        yaml_dict["metadata"]["audio samples"] = zsounds
+
+    # There is no old .metadata to keep, and YAML text always compresses well, so both of those deflate
+    method, level = (compression or CompressionPolicy()).for_member(metadata_member)
+    info = zipfile.ZipInfo(metadata_member)
+    info.compress_type = COMPRESSION_METHODS.get(method, zipfile.ZIP_DEFLATED)
+    info._compresslevel = level
+
+    with new_archive.open(info, "w") as member, io.TextIOWrapper(member, encoding="utf-8") as f:
+        f.write(dump_metadata(yaml_dict))
+
+
+def member_data_offset(source_view: memoryview, info: zipfile.ZipInfo) -> int:
+    ''' Finds where a member's compressed data starts in a view of the whole archive, checking it all lies inside '''
+    try:
+        header = struct.unpack_from(zipfile.structFileHeader, source_view, info.header_offset)
+    except struct.error:
+        raise zipfile.BadZipFile(f'member_data_offset Error: Truncated local file header for "{info.filename}"!')
+
+    if header[LOCAL_HEADER_SIGNATURE] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f'member_data_offset Error: Bad local file header for "{info.filename}"!')
+
+    offset = info.header_offset + zipfile.sizeFileHeader + header[LOCAL_HEADER_NAME_LENGTH] + header[LOCAL_HEADER_EXTRA_LENGTH]
+    if offset + info.compress_size > len(source_view):
+        raise zipfile.BadZipFile(f'member_data_offset Error: Truncated data for "{info.filename}"!')
+
+    return offset
+
+
+@contextmanager
+def read_member(zip_archive: zipfile.ZipFile, name: str, source_view: memoryview = None) -> Iterator[bytes | memoryview]:
+    '''
+    Reads a member, or with a view of the whole archive, hands out a stored member as a slice of it without
+    copying. The slice is released on exit, so nothing built on it may outlive the with block.
+    '''
+    info = zip_archive.getinfo(name)
+    if source_view is None or info.compress_type != zipfile.ZIP_STORED or info.flag_bits & ENCRYPTED_FLAG:
+        yield zip_archive.read(info)
+        return
+
+    offset = member_data_offset(source_view, info)
+    with source_view[offset:offset + info.compress_size] as data:
+        # zipfile checks the CRC of what it reads, so the slice is held to the same standard
+        if zlib.crc32(data) != info.CRC:
+            raise zipfile.BadZipFile(f'read_member Error: Bad CRC-32 for "{name}"!')
+        yield data
+
+
+def copy_raw_member(source_archive: zipfile.ZipFile, new_archive: zipfile.ZipFile, info: zipfile.ZipInfo, source_view: memoryview = None) -> None:
+    ''' Copies a member's compressed bytes and CRC into the new archive without recompressing them '''
+    # Locate the compressed data behind the member's local file header
+    if source_view is not None:
+        offset = member_data_offset(source_view, info)
+    else:
+        source = source_archive.fp
+        source.seek(info.header_offset)
+        header = struct.unpack(zipfile.structFileHeader, source.read(zipfile.sizeFileHeader))
+
+        if header[LOCAL_HEADER_SIGNATURE] != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile(f'copy_raw_member Error: Bad local file header for "{info.filename}"!')
+
+        source.seek(header[LOCAL_HEADER_NAME_LENGTH] + header[LOCAL_HEADER_EXTRA_LENGTH], os.SEEK_CUR)
+
+    new_info = zipfile.ZipInfo(info.filename, info.date_time)
+    new_info.compress_type = info.compress_type
+    new_info.external_attr = info.external_attr
+    new_info.CRC = info.CRC
+    new_info.compress_size = info.compress_size
+    new_info.file_size = info.file_size
+    # Sizes and CRC are known up front, so the new header carries them instead of a data descriptor
+    new_info.flag_bits = info.flag_bits & ~DATA_DESCRIPTOR_FLAG
+
+    # zipfile has no public API for writing pre-compressed data, so this mirrors ZipFile.mkdir
+    with new_archive._lock:
+        new_archive._writecheck(new_info)
+        new_archive._didModify = True
+
+        if new_archive._seekable:
+            new_archive.fp.seek(new_archive.start_dir)
+        new_info.header_offset = new_archive.fp.tell()
+        new_archive.fp.write(new_info.FileHeader())
+
+        if source_view is not None:
+            # Written straight from the mapping, so the data is never copied into Python objects
+            for start in range(offset, offset + info.compress_size, COPY_CHUNK_SIZE):
+                with source_view[start:min(start + COPY_CHUNK_SIZE, offset + info.compress_size)] as chunk:
+                    new_archive.fp.write(chunk)
+        else:
+            remaining = info.compress_size
+            while remaining > 0:
+                chunk = source.read(min(remaining, COPY_CHUNK_SIZE))
+                if not chunk:
+                    raise zipfile.BadZipFile(f'copy_raw_member Error: Truncated data for "{info.filename}"!')
+                new_archive.fp.write(chunk)
+                remaining -= len(chunk)
+
+        new_archive.filelist.append(new_info)
+        new_archive.NameToInfo[new_info.filename] = new_info
+        new_archive.start_dir = new_archive.fp.tell()
+
+
+def copy_archive_files(source_archive: zipfile.ZipFile, new_archive: zipfile.ZipFile, compression: CompressionPolicy = None,
+                       source_view: memoryview = None) -> int:
+    ''' Streams the contents of the original archive into the new archive, returning the bytes copied '''
+    skip_extensions: list[str] = ['.meta']  # Skip the old metadata file
+    compression = compression or CompressionPolicy()
+    copied_bytes = 0
+
+    for info in source_archive.infolist():
+        extension: str = os.path.splitext(info.filename)[1]
+
+        if info.is_dir() or extension.lower() in skip_extensions:
+            continue
+
+        copied_bytes += info.file_size
+        method, level = compression.for_member(info.filename)
+
+        if method == 'auto':
+            with source_archive.open(info) as src:
+                method = 'store' if is_poorly_compressible(src.read(AUTO_TRIAL_SIZE)) else 'deflate'
+
+        # A member that already uses the method it should, with no particular level asked for, is copied as it is
+        if method == 'keep' or (info.compress_type == COMPRESSION_METHODS[method] and (method == 'store' or level is None)):
+            copy_raw_member(source_archive, new_archive, info, source_view)
+            continue
+
+        new_info = zipfile.ZipInfo(info.filename, info.date_time)
+        new_info.compress_type = COMPRESSION_METHODS[method]
+        # zipfile only takes a level per member through this attribute
+        new_info._compresslevel = level
+        new_info.external_attr = info.external_attr
+        new_info.file_size = info.file_size
+
+        with source_archive.open(info) as src, new_archive.open(new_info, 'w') as dst:
+            shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+
+    return copied_bytes
+
+
+@contextmanager
+def pack(filename: str, destination_dir: str):
+    ''' Opens a new .ootrs file for writing, which replaces the old one in a single step once it is complete '''
+    mmrs_path = os.path.join(destination_dir, f"{filename}.ootrs")
+    # Unique per worker, so that two workers writing the same file never share a temporary file
+    temp_path = f"{mmrs_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    try:
+        with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as new_archive:
+            yield new_archive
+        os.replace(temp_path, mmrs_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class MetaDiagnostic:
+    ''' Something in a .meta file that was ignored or corrected, and the line it is on '''
+
+    def __init__(self, line: int, message: str):
+        self.line = line
+        self.message = message
+
+    def __str__(self) -> str:
+        return f"Line {self.line}: {self.message}"
+
+
+class MetaFile:
+    ''' The contents of a legacy .meta file '''
+
+    def __init__(self, cosmetic_name: str, instrument_set: str | int, song_type: str, music_groups: list[str],
+                 zsounds: dict[str, dict[str, int | str]], diagnostics: list[MetaDiagnostic]):
+        self.cosmetic_name = cosmetic_name
+        self.instrument_set = instrument_set
+        self.song_type = song_type
+        self.music_groups = music_groups
+        self.zsounds = zsounds
+        self.diagnostics = diagnostics
+
+    def as_tuple(self) -> tuple[str, str | int, str, list[str], dict]:
+        return self.cosmetic_name, self.instrument_set, self.song_type, self.music_groups, self.zsounds
+
+
+def parse_meta(meta_file: TextIO) -> MetaFile:
+    '''
+    Reads a .meta stream in a single pass, telling the two ZSOUND styles apart without raising.
+
+    Expected format:
+    Line 1: cosmetic name
+    Line 2: instrument set
+    Line 3: song type
+    Line 4: music groups (comma-separated list)
+    Line 5+: meta commands
+
+    A missing or invalid required line raises ValueError naming the line; anything ignored or corrected
+    along the way is kept in the result's diagnostics.
+    '''
+    header: list[str] = []
+    zsounds: dict[str, dict[str, int | str]] = {}
+    diagnostics: list[MetaDiagnostic] = []
+
+    for line_number, line in enumerate(meta_file, 1):
+        line = line.rstrip()
+
+        if line_number <= 4:
+            header.append(line)
+            continue
+
+        tokens = line.split(':')
+
+        if tokens[0] != 'ZSOUND':
+            if line:
+                diagnostics.append(MetaDiagnostic(line_number, f'Ignored unknown command "{tokens[0]}".'))
+            continue
+
+        # New style: ZSOUND:instrument type:list index:key region:file
+        if len(tokens) >= 5 and is_decimal(tokens[2]):
+            key_region = tokens[3]
+            if key_region not in KEY_REGIONS:
+                diagnostics.append(MetaDiagnostic(line_number, f'Unknown key region "{key_region}", using "PRIM" instead.'))
+                key_region = "PRIM"
+
+            zsounds[tokens[4]] = {
+                "instrument type": tokens[1],
+                "list index": int(tokens[2]),
+                "key region": key_region
+            }
+
+        # Old style: ZSOUND:file:temp address
+        elif len(tokens) >= 3 and is_hexadecimal(tokens[2]):
+            zsounds[tokens[1]] = {
+                "temp address": int(tokens[2], 16)
+            }
+
+        else:
+            raise ValueError(f'parse_meta Error: Expected "ZSOUND:type:index:key region:file" or "ZSOUND:file:address" for line {line_number}, but got "{line}" instead.')
+
+    if len(header) < 1:
+        raise ValueError('parse_meta Error: Expected cosmetic name for line 1, but the file is empty.')
+    if len(header) < 2:
+        raise ValueError('parse_meta Error: Expected instrument set for line 2, but the file ends after line 1.')
+
+    cosmetic_name = header[0]
+
+    if header[1] == "bgm" or header[1] == "fanfare":
+        raise ValueError(f'parse_meta Error: Expected instrument set for line 2, but got "{header[1]}" instead.')
+
+    if header[1] == '-':
+        instrument_set = "custom"
+    elif is_hexadecimal(header[1]):
+        instrument_set = int(header[1], 16)
+    else:
+        raise ValueError(f'parse_meta Error: Expected "-" or a hexadecimal instrument set for line 2, but got "{header[1]}" instead.')
+
+    song_type = header[2].lower() if len(header) >= 3 else "bgm"
+
+    if len(header) >= 4:
+        music_groups = header[3].split(',')
+    else:
+        music_groups = DEFAULT_BGM_CATEGORIES if song_type == "bgm" else DEFAULT_FANFARE_CATEGORIES
+
+    return MetaFile(cosmetic_name, instrument_set, song_type, music_groups, zsounds, diagnostics)
+
+
+def is_decimal(text: str) -> bool:
+    ''' Checks whether int() reads the text, without paying for the exception when it does not '''
+    return text.isdecimal() or DECIMAL_PATTERN.fullmatch(text) is not None
+
+
+def is_hexadecimal(text: str) -> bool:
+    ''' Checks whether int(text, 16) reads the text, without paying for the exception when it does not '''
+    return HEXADECIMAL_PATTERN.fullmatch(text) is not None
+
+
+def process_meta_file(meta_file: TextIO) -> tuple[str, str | int, str, list[str], dict]:
+    ''' Extracts data from the archive's .meta file '''
+    return parse_meta(meta_file).as_tuple()
+
+
+def relink_zsounds(zsounds: dict[str, dict], address_index: dict[int, SampleLink]) -> None:
+    ''' Replaces legacy temp addresses with the instrument, drum or sound effect that uses the sample '''
+    for key, value in list(zsounds.items()):
+        if key and value and "temp address" in value:
+            link = address_index.get(value['temp address'])
+            if link is not None:
+                parent_type, parent_index, key_region = link
+                zsounds[key] = {
+                    "instrument type": parent_type,
+                    "list index": parent_index
+                }
+
+                # Only instrument samples have a key region
+                if key_region is not None:
+                    zsounds[key]["key region"] = key_region
+
+
+def convert_zip(zip_archive: zipfile.ZipFile, open_output: Callable[[], ContextManager[zipfile.ZipFile]], timer: StageTimer = None,
+                bank_cache: BankCache = None, compression: CompressionPolicy = None, source_view: memoryview = None,
+                diagnostics: list[MetaDiagnostic] = None) -> bool:
+    '''
+    Converts an open .ootrs archive into the archive open_output opens, returning False if it was skipped.
+
+    With a view of the whole archive, stored members are read and copied out of it instead of through zipfile.
+    Lines of the .meta file that were ignored or corrected are added to diagnostics when it is given.
+    '''
+    timer = timer or StageTimer()
+
+    archive = MusicArchive(zip_archive)
+    try:
+        archive.read_members()
+    except SkipFileException:
+        return False
+
+    with timer.stage('meta'):
+        meta_name: str = os.path.splitext(os.path.basename(archive.meta))[0]
+        with zip_archive.open(archive.meta) as meta_member, io.TextIOWrapper(meta_member) as meta_file:
+            meta = parse_meta(meta_file)
+        cosmetic_name, instrument_set, song_type, music_groups, zsounds = meta.as_tuple()
+        if diagnostics is not None:
+            diagnostics.extend(meta.diagnostics)
+        timer.add_bytes('meta', zip_archive.getinfo(archive.meta).file_size)
+
+    # Archives without legacy temp addresses never need their bank read
+    needs_relinking = any(key and value and "temp address" in value for key, value in zsounds.items())
+
+    if needs_relinking and archive.bankmeta and archive.bank:
+        with timer.stage('relink'):
+            bankmeta_data = zip_archive.read(archive.bankmeta)
+            with read_member(zip_archive, archive.bank, source_view) as zbank_data:
+                timer.add_bytes('relink', len(bankmeta_data) + len(zbank_data))
+
+                # Archives that ship the same bank share one parsed index
+                if bank_cache is not None:
+                    address_index = bank_cache.get_address_index(bankmeta_data, zbank_data)
+                else:
+                    # Without a cache only the temp addresses are looked up, so the bank is decoded no further than it must be
+                    temp_addresses = {value['temp address'] for key, value in zsounds.items() if key and value and "temp address" in value}
+                    audiobank = Audiobank(bankmeta_data, zbank_data)
+                    try:
+                        address_index = find_address_links(audiobank, temp_addresses)
+                    finally:
+                        audiobank.release()
+
+            relink_zsounds(zsounds, address_index)
+
+    with timer.stage('pack'), open_output() as new_archive:
+        timer.add_bytes('pack', copy_archive_files(zip_archive, new_archive, compression, source_view))
+
+        with timer.stage('metadata'):
+            write_metadata(new_archive, meta_name, cosmetic_name, instrument_set, song_type, music_groups, zsounds, compression)
+            timer.add_bytes('metadata', new_archive.getinfo(f"{meta_name}.metadata").file_size)
+
+    return True
+
+
+def convert_archive(input_file: str, destination_dir: str, timer: StageTimer = None, bank_cache: BankCache = None,
+                    compression: CompressionPolicy = None, map_archive: bool = False, diagnostics: list[MetaDiagnostic] = None) -> bool:
+    '''
+    Converts an .ootrs file into the YAML metadata .ootrs format, returning False if it was skipped.
+
+    With map_archive, the file is memory-mapped so its stored members are read from the OS page cache
+    instead of being copied into each worker. Lines of the .meta file that were ignored or corrected are
+    added to diagnostics when it is given.
+    '''
+    filename = os.path.splitext(os.path.basename(input_file))[0]
+    filepath = os.path.abspath(input_file)
+    timer = timer or StageTimer()
+
+    try:
+        with timer.stage('open'), zipfile.ZipFile(filepath, 'r') as zip_archive:
+            timer.add_bytes('open', os.path.getsize(filepath))
+            open_output = lambda: pack(f'{filename}', destination_dir)
+
+            if not map_archive:
+                return convert_zip(zip_archive, open_output, timer, bank_cache, compression, diagnostics=diagnostics)
+
+            # The view is released before the mapping closes, which fails while any slice of it is still alive
+            with mmap.mmap(zip_archive.fp.fileno(), 0, access=mmap.ACCESS_READ) as mapping, memoryview(mapping) as source_view:
+                return convert_zip(zip_archive, open_output, timer, bank_cache, compression, source_view, diagnostics)
+
+    except Exception as e:
+        raise Exception(e)
+
+
+def convert_bytes(ootrs_bytes: bytes, timer: StageTimer = None, bank_cache: BankCache = None, compression: CompressionPolicy = None) -> bytes:
+    ''' Converts an .ootrs file held in memory, raising SkipFileException if it is already converted '''
+    timer = timer or StageTimer()
+    output = io.BytesIO()
+
+    with timer.stage('open'), zipfile.ZipFile(io.BytesIO(ootrs_bytes), 'r') as zip_archive:
+        timer.add_bytes('open', len(ootrs_bytes))
+        if not convert_zip(zip_archive, lambda: zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED), timer, bank_cache, compression):
+            raise SkipFileException("Archive contains .metadata, skipping.")
+
+    return output.getvalue()
+
+
+class ConvertedArchive:
+    ''' The outcome of converting one archive of a batch '''
+
+    def __init__(self, name: str, data: bytes | None, converted: bool, error: Exception = None):
+        self.name = name
+        self.data = data
+        self.converted = converted
+        self.error = error
+
+
+def try_convert_bytes(name: str, ootrs_bytes: bytes, bank_cache: BankCache = None, compression: CompressionPolicy = None) -> ConvertedArchive:
+    ''' Converts one archive held in memory, returning a failure as the result instead of raising it '''
+    try:
+        return ConvertedArchive(name, convert_bytes(ootrs_bytes, bank_cache=bank_cache, compression=compression), True)
+    except SkipFileException:
+        return ConvertedArchive(name, ootrs_bytes, False)
+    except Exception as e:
+        return ConvertedArchive(name, None, False, e)
+
+
+def iter_convert_bytes(archives: Iterable[tuple[str, bytes]], bank_cache: BankCache = None,
+                       compression: CompressionPolicy = None) -> Iterator[ConvertedArchive]:
+    '''
+    Converts (name, .ootrs bytes) pairs one at a time as they are consumed.
+
+    Archives that are already converted come back unchanged, and archives that fail come back with their
+    error instead of stopping the batch. Every archive in the batch shares one bank cache.
+    '''
+    bank_cache = bank_cache if bank_cache is not None else BankCache()
+
+    for name, ootrs_bytes in archives:
+        yield try_convert_bytes(name, ootrs_bytes, bank_cache, compression)
@@ -0,0 +1,226 @@
+import argparse
+import asyncio
+import os
+import struct
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Final, Iterable
+
+from utils.BankCache import BankCache
+from utils.Converter import CompressionPolicy, ConvertedArchive, try_convert_bytes
+
+
+# Frame headers: a request carries its job id, name length and archive length; a response its job id, status and payload length
+REQUEST_HEADER: Final = struct.Struct('>III')
+RESPONSE_HEADER: Final = struct.Struct('>IBI')
+
+# Response statuses; a skipped archive is sent back unchanged and a failed one carries its error message
+STATUS_CONVERTED: Final[int] = 0
+STATUS_SKIPPED: Final[int]   = 1
+STATUS_FAILED: Final[int]    = 2
+
+# Largest archive and name a client may send, so that a bad header cannot make the server allocate without bound
+MAX_ARCHIVE_SIZE: Final[int] = 256 * 1024 * 1024
+MAX_NAME_LENGTH: Final[int] = 4096
+
+DEFAULT_PORT: Final[int] = 8613
+
+
+class ConversionService:
+    '''
+    Converts archives for an asyncio application.
+
+    The conversions run in an executor that lives as long as the service, with at most max_jobs of them
+    running at once; every other job waits on the semaphore without holding a thread. Each connection
+    has at most max_connection_jobs archives in memory, and stops reading until one of them is done. All
+    state belongs to the instance, so several services can run in one process.
+    '''
+
+    def __init__(self, max_jobs: int = None, executor: Executor = None, bank_cache: BankCache = None,
+                 compression: CompressionPolicy = None, max_connection_jobs: int = None):
+        self.max_jobs = max_jobs or os.cpu_count() or 1
+        self.max_connection_jobs = max_connection_jobs or self.max_jobs
+        self.semaphore = asyncio.Semaphore(self.max_jobs)
+        self.owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix='ootrs-service')
+        # A process pool cannot share a cache with the service, so each job there parses its own bank
+        self.bank_cache = None if isinstance(self.executor, ProcessPoolExecutor) else (bank_cache or BankCache())
+        self.compression = compression
+
+    async def convert(self, name: str, ootrs_bytes: bytes) -> ConvertedArchive:
+        ''' Converts one archive, waiting for a free slot first '''
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, partial(try_convert_bytes, name, ootrs_bytes, self.bank_cache, self.compression))
+
+    async def convert_many(self, archives: Iterable[tuple[str, bytes]]) -> AsyncIterator[ConvertedArchive]:
+        ''' Converts (name, .ootrs bytes) pairs concurrently, yielding each result as soon as it is ready '''
+        tasks = [asyncio.ensure_future(self.convert(name, ootrs_bytes)) for name, ootrs_bytes in archives]
+
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        ''' Serves one client, converting its jobs concurrently and writing each result back as it finishes '''
+        jobs: set[asyncio.Task] = set()
+        # Taken before each frame is read, so a client cannot queue up more archives than this connection may hold
+        in_flight = asyncio.Semaphore(self.max_connection_jobs)
+
+        async def run_job(job_id: int, name: str, ootrs_bytes: bytes) -> None:
+            try:
+                result = await self.convert(name, ootrs_bytes)
+
+                if result.error is not None:
+                    status, payload = STATUS_FAILED, str(result.error).encode('utf-8')
+                else:
+                    status, payload = (STATUS_CONVERTED if result.converted else STATUS_SKIPPED), result.data
+
+                # A single write keeps the frame whole even when several jobs finish together
+                writer.write(RESPONSE_HEADER.pack(job_id, status, len(payload)) + payload)
+                await writer.drain()
+            finally:
+                in_flight.release()
+
+        try:
+            while True:
+                await in_flight.acquire()
+                try:
+                    header = await reader.readexactly(REQUEST_HEADER.size)
+                except asyncio.IncompleteReadError:
+                    break
+
+                job_id, name_length, data_length = REQUEST_HEADER.unpack(header)
+                if name_length > MAX_NAME_LENGTH:
+                    raise ValueError(f'ConversionService Error: Job {job_id} has a {name_length} byte name, over the {MAX_NAME_LENGTH} byte limit!')
+                if data_length > MAX_ARCHIVE_SIZE:
+                    raise ValueError(f'ConversionService Error: Job {job_id} is {data_length} bytes, over the {MAX_ARCHIVE_SIZE} byte limit!')
+
+                name = (await reader.readexactly(name_length)).decode('utf-8')
+                ootrs_bytes = await reader.readexactly(data_length)
+
+                job = asyncio.create_task(run_job(job_id, name, ootrs_bytes))
+                jobs.add(job)
+                job.add_done_callback(jobs.discard)
+
+            if jobs:
+                await asyncio.gather(*jobs)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            for job in jobs:
+                job.cancel()
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = DEFAULT_PORT) -> asyncio.AbstractServer:
+        ''' Starts accepting clients; the returned server is closed by the caller '''
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    def close(self) -> None:
+        if self.owns_executor:
+            self.executor.shutdown(wait=True)
+
+
+class ConversionClient:
+    ''' Sends jobs to a ConversionService over TCP; many jobs can be in flight on one connection '''
+
+    def __init__(self, host: str = '127.0.0.1', port: int = DEFAULT_PORT):
+        self.host = host
+        self.port = port
+        self.reader: asyncio.StreamReader = None
+        self.writer: asyncio.StreamWriter = None
+        self.pending: dict[int, tuple[str, asyncio.Future]] = {}
+        self.next_job_id = 0
+        self.receiver: asyncio.Task = None
+
+    async def connect(self) -> None:
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.receiver = asyncio.create_task(self.receive())
+
+    async def receive(self) -> None:
+        ''' Resolves each pending job as its response arrives, in whatever order the service finishes them '''
+        try:
+            while True:
+                job_id, status, payload_length = RESPONSE_HEADER.unpack(await self.reader.readexactly(RESPONSE_HEADER.size))
+                payload = await self.reader.readexactly(payload_length)
+                name, future = self.pending.pop(job_id)
+
+                if status == STATUS_CONVERTED:
+                    result = ConvertedArchive(name, payload, True)
+                elif status == STATUS_SKIPPED:
+                    result = ConvertedArchive(name, payload, False)
+                else:
+                    result = ConvertedArchive(name, None, False, Exception(payload.decode('utf-8')))
+
+                if not future.done():
+                    future.set_result(result)
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            for name, future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f'ConversionClient Error: Connection lost before "{name}" was converted: {e}'))
+            self.pending.clear()
+
+    async def convert(self, name: str, ootrs_bytes: bytes) -> ConvertedArchive:
+        job_id = self.next_job_id
+        self.next_job_id = (self.next_job_id + 1) & 0xFFFFFFFF
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[job_id] = (name, future)
+
+        encoded_name = name.encode('utf-8')
+        self.writer.write(REQUEST_HEADER.pack(job_id, len(encoded_name), len(ootrs_bytes)) + encoded_name + ootrs_bytes)
+        await self.writer.drain()
+
+        return await future
+
+    async def close(self) -> None:
+        self.writer.close()
+        await self.writer.wait_closed()
+        if self.receiver is not None:
+            await self.receiver
+
+
+class LocalClient:
+    ''' Stands in for ConversionClient by calling a service in the same process, for tests and embedding '''
+
+    def __init__(self, service: ConversionService):
+        self.service = service
+
+    async def connect(self) -> None:
+        pass
+
+    async def convert(self, name: str, ootrs_bytes: bytes) -> ConvertedArchive:
+        return await self.service.convert(name, ootrs_bytes)
+
+    async def close(self) -> None:
+        pass
+
+
+async def run_service(host: str, port: int, max_jobs: int = None) -> None:
+    service = ConversionService(max_jobs)
+    try:
+        server = await service.serve(host, port)
+        async with server:
+            print(f"Converting archives on {host}:{port} with up to {service.max_jobs} jobs at once")
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main(argv: list[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Serves .ootrs conversions over TCP.")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="conversions run at once (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(run_service(args.host, args.port, args.jobs))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()